@@ -0,0 +1,46 @@
+"""bench -- micro-benchmarks
+
+Each benchmark module defines a benchmarks() procedure that produces
+result dictionaries (see measure()).  Run a module directly to print
+its results as JSON, one result per line:
+
+    python -m bench.stm
+"""
+
+from __future__ import absolute_import
+import sys, json, timeit
+
+__all__ = ('measure', 'report', 'main')
+
+def measure(name, proc, number=None, repeat=3, **info):
+    """Time proc() and return a result dictionary.  If number is not
+    given, it is calibrated so that each repetition takes at least
+    0.2 seconds.  Any keyword arguments are included in the result."""
+
+    timer = timeit.Timer(proc)
+    if number is None:
+        number = calibrate(timer)
+    best = min(timer.repeat(repeat, number))
+    return dict(
+        info,
+        name=name,
+        number=number,
+        seconds=best,
+        usec=(best / number) * 1e6
+    )
+
+def calibrate(timer, minimum=0.2):
+    number = 1
+    while timer.timeit(number) < minimum:
+        number *= 10
+    return number
+
+def report(results, port=None):
+    port = port or sys.stdout
+    for result in results:
+        port.write(json.dumps(result, sort_keys=True))
+        port.write('\n')
+        port.flush()
+
+def main(benchmarks):
+    report(benchmarks())
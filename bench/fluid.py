@@ -0,0 +1,101 @@
+"""bench.fluid -- dynamic environment benchmarks"""
+
+from __future__ import absolute_import
+from contextlib import contextmanager
+from md import fluid
+from . import measure, main
+
+TYPES = (
+    fluid.shared, fluid.acquired, fluid.copied, fluid.deepcopied,
+    fluid.private
+)
+
+@contextmanager
+def nested(depth):
+    """Bind depth unrelated cells, one let() each."""
+
+    cells = [fluid.cell(i) for i in xrange(depth)]
+    contexts = [c.let(i) for (i, c) in enumerate(cells)]
+    for context in contexts:
+        context.__enter__()
+    try:
+        yield
+    finally:
+        for context in reversed(contexts):
+            context.__exit__(None, None, None)
+
+def access(depths=(0, 10, 100)):
+    cell = fluid.cell(0)
+    bound = fluid.cell(0)
+    for depth in depths:
+        with bound.let(1):
+            with nested(depth):
+                yield measure('fluid.get.global', cell.get, depth=depth)
+                yield measure('fluid.get.bound', bound.get, depth=depth)
+                yield measure(
+                    'fluid.set.bound', lambda: bound.set(2), depth=depth
+                )
+
+def accessor():
+    access = fluid.accessor(fluid.cell(0), name='access')
+    yield measure('fluid.accessor.get', access)
+    yield measure('fluid.accessor.let', lambda: enter(access(1)))
+
+def let(depths=(0, 100)):
+    cell = fluid.cell(0)
+    cells = [fluid.cell(i) for i in xrange(10)]
+    bindings = [(c, i) for (i, c) in enumerate(cells)]
+    for depth in depths:
+        with nested(depth):
+            yield measure(
+                'fluid.let.one', lambda: enter(cell.let(1)), depth=depth
+            )
+            yield measure(
+                'fluid.let.many', lambda: enter(fluid.let(*bindings)),
+                depth=depth, cells=len(bindings)
+            )
+
+def enter(context):
+    with context:
+        pass
+
+def localize(count=100):
+    for kind in TYPES:
+        cells = [fluid.cell(type=kind) for _ in xrange(count)]
+        with fluid.let(*[(c, [i]) for (i, c) in enumerate(cells)]):
+            yield measure(
+                'fluid.localize', fluid.LOCAL.localize,
+                type=kind.__name__, cells=count
+            )
+
+def spawn(counts=(0, 100)):
+    for count in counts:
+        cells = [fluid.cell(type=fluid.deepcopied) for _ in xrange(count)]
+        with fluid.let(*[(c, [i]) for (i, c) in enumerate(cells)]):
+            yield measure(
+                'fluid.thread.start', lambda: run(lambda: None),
+                number=100, cells=count
+            )
+            yield measure(
+                'fluid.thread.read', lambda: run(lambda: read(cells)),
+                number=100, cells=count
+            )
+
+def run(proc):
+    ## fluid.Thread captures the environment whether or not threading
+    ## is patched (see fluid.install()).
+    thread = fluid.Thread(target=proc)
+    thread.start()
+    thread.join()
+
+def read(cells):
+    for cell in cells:
+        cell.value
+
+def benchmarks():
+    for group in (access, accessor, let, localize, spawn):
+        for result in group():
+            yield result
+
+if __name__ == '__main__':
+    main(benchmarks)
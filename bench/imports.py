@@ -0,0 +1,54 @@
+"""bench.imports -- import time benchmarks
+
+Each module is imported in a fresh interpreter, so nothing is cached
+in sys.modules.
+"""
+
+from __future__ import absolute_import
+import os, sys, subprocess
+from . import main
+
+PROBE = '''
+import sys, time
+start = time.time()
+import %s
+sys.stdout.write('%%r %%d' %% (time.time() - start, len(sys.modules)))
+'''
+
+def imported(module, repeat=5, **environ):
+    """Return the best time (in seconds) to import module and the
+    number of modules loaded afterwards."""
+
+    env = dict(os.environ, **environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root(), env.get('PYTHONPATH')])
+    )
+    best = None
+    for _ in xrange(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', PROBE % module],
+            env=env
+        )
+        (seconds, modules) = output.split()
+        seconds = float(seconds)
+        if best is None or seconds < best:
+            best = seconds
+    return (best, int(modules))
+
+def root():
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def benchmarks():
+    for module in ('md.fluid', 'md.stm'):
+        for patch in ('1', '0'):
+            (seconds, modules) = imported(module, MD_FLUID_PATCH=patch)
+            yield dict(
+                name='import %s' % module,
+                patched=(patch == '1'),
+                seconds=seconds,
+                usec=seconds * 1e6,
+                modules=modules
+            )
+
+if __name__ == '__main__':
+    main(benchmarks)
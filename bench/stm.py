@@ -0,0 +1,106 @@
+"""bench.stm -- transactional memory benchmarks"""
+
+from __future__ import absolute_import
+import sys
+from md import stm
+from md.stm.wsgi import middleware
+from . import measure, main
+
+class counted(stm.journal):
+    """A journal that counts how many times it is allocated."""
+
+    allocated = 0
+
+    def __init__(self, name, source):
+        type(self).allocated += 1
+        super(counted, self).__init__(name, source)
+
+class counted_memory(stm.memory):
+    JournalType = counted
+
+def empty():
+    with stm.transaction():
+        pass
+
+def write(cursor):
+    with stm.transaction():
+        cursor.value = 1
+
+def allocations(proc, number=1000):
+    """Return the number of journals allocated per call to proc()."""
+
+    counted.allocated = 0
+    for _ in xrange(number):
+        proc()
+    return float(counted.allocated) / number
+
+def transactions(pool_size):
+    with stm.use(counted_memory(pool_size=pool_size)):
+        with stm.transaction():
+            cursor = stm.cursor()
+
+        procs = (('empty', empty), ('write', lambda: write(cursor)))
+        for (name, proc) in procs:
+            yield measure(
+                'stm.transaction.%s' % name, proc,
+                pool_size=pool_size,
+                journals=allocations(proc)
+            )
+
+def paging(size=10000, page=100):
+    with stm.transaction():
+        items = stm.list(xrange(size))
+
+    def pages():
+        with stm.transaction():
+            for start in xrange(0, size, page):
+                items[start:start + page]
+
+    return measure('stm.list.pages', pages, size=size, page=page)
+
+class point(stm.record('point', 'x y')):
+    pass
+
+class plain(stm.cursor):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+def move(cursor):
+    with stm.transaction():
+        cursor.x += 1
+
+def records():
+    with stm.transaction():
+        cursors = [('record', point(1, 2)), ('cursor', plain(1, 2))]
+
+    for (name, cursor) in cursors:
+        yield measure(
+            'stm.%s.getattr' % name, lambda: cursor.x,
+            bytes=sys.getsizeof(stm.readable(cursor))
+        )
+        yield measure('stm.%s.setattr' % name, lambda: move(cursor))
+
+def requests():
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        return ['']
+
+    environ = {}
+    wrapped = middleware(app, attempts=1)
+    return measure(
+        'stm.wsgi.request',
+        lambda: wrapped(environ, lambda status, headers: None)
+    )
+
+def benchmarks():
+    for pool_size in (0, 8):
+        for result in transactions(pool_size):
+            yield result
+    yield paging()
+    for result in records():
+        yield result
+    yield requests()
+
+if __name__ == '__main__':
+    main(benchmarks)
@@ -0,0 +1,15 @@
+"""Tasks for the process pool examples in md.executors.  Cells and
+procedures must be importable by the worker processes."""
+
+from md import fluid
+
+__all__ = ('NAME', 'OPTIONS', 'name', 'option')
+
+NAME = fluid.cell('global')
+OPTIONS = fluid.cell({}, type=fluid.copied)
+
+def name(n):
+    return (n, NAME.value)
+
+def option(key):
+    return OPTIONS.value.get(key)
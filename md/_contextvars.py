@@ -0,0 +1,134 @@
+"""_contextvars -- a stand-in for the contextvars module (PEP 567)
+
+Each thread has a current Context.  A scheduler that runs many tasks
+in one thread gives each task its own context by running each step of
+the task with Context.run().
+"""
+
+from __future__ import absolute_import
+import threading
+
+__all__ = ('Context', 'ContextVar', 'Token', 'copy_context')
+
+class MISSING(object): pass
+MISSING = MISSING()
+
+_local = threading.local()
+
+def current():
+    try:
+        return _local.context
+    except AttributeError:
+        context = _local.context = Context()
+        return context
+
+def copy_context():
+    """Return a copy of the current context."""
+
+    return current().copy()
+
+class Context(object):
+    """A mapping of context variables to their values."""
+
+    def __init__(self):
+        self._data = {}
+        self._entered = False
+
+    def run(self, proc, *args, **kwargs):
+        """Call proc in this context."""
+
+        if self._entered:
+            raise RuntimeError('Cannot enter context: already entered.', self)
+        saved = current()
+        _local.context = self
+        self._entered = True
+        try:
+            return proc(*args, **kwargs)
+        finally:
+            self._entered = False
+            _local.context = saved
+
+    def copy(self):
+        new = type(self)()
+        new._data = dict(self._data)
+        return new
+
+    def __getitem__(self, var):
+        return self._data[var]
+
+    def __contains__(self, var):
+        return var in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def get(self, var, default=None):
+        return self._data.get(var, default)
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._data.values()
+
+    def items(self):
+        return self._data.items()
+
+class ContextVar(object):
+    __slots__ = ('__weakref__', '_name', '_default')
+
+    def __init__(self, name, default=MISSING):
+        self._name = name
+        self._default = default
+
+    def __repr__(self):
+        return '<%s name=%r>' % (type(self).__name__, self._name)
+
+    name = property(lambda s: s._name)
+
+    def get(self, default=MISSING):
+        try:
+            return current()._data[self]
+        except KeyError:
+            if default is not MISSING:
+                return default
+            elif self._default is not MISSING:
+                return self._default
+            raise LookupError(self)
+
+    def set(self, value):
+        context = current()
+        token = Token(context, self, context._data.get(self, Token.MISSING))
+        context._data[self] = value
+        return token
+
+    def reset(self, token):
+        if token._used:
+            raise RuntimeError('Token has already been used once.', token)
+        elif token._var is not self:
+            raise ValueError('Token was created by a different ContextVar.')
+        context = current()
+        if token._context is not context:
+            raise ValueError('Token was created in a different Context.')
+        token._used = True
+        if token._old is Token.MISSING:
+            context._data.pop(self, None)
+        else:
+            context._data[self] = token._old
+
+class Token(object):
+    __slots__ = ('_context', '_var', '_old', '_used')
+
+    MISSING = MISSING
+
+    def __init__(self, context, var, old):
+        self._context = context
+        self._var = var
+        self._old = old
+        self._used = False
+
+    var = property(lambda s: s._var)
+    old_value = property(lambda s: s._old)
@@ -0,0 +1,202 @@
+"""executors -- thread and process pools that propagate fluid bindings"""
+
+from __future__ import absolute_import
+import os, threading, cPickle as pickle
+from multiprocessing import pool
+from . import fluid
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+__all__ = ('bound', 'ThreadPool', 'Pool')
+
+def bound(proc):
+    """Capture the current dynamic environment.  Return a procedure
+    that calls proc in that environment from any thread."""
+
+    top = CAPTURES.capture()
+
+    def call(*args, **kwargs):
+        with fluid.LOCAL.installed(fluid.LOCAL.branch(top)):
+            return proc(*args, **kwargs)
+
+    return call
+
+class captures(threading.local):
+    """Reuse the environment captured by this thread while its scope
+    is the same.  A capture isn't reused once the thread has set an
+    acquired cell it captured (its saved values aren't empty) or if
+    it copied cells, which must be copied for every task."""
+
+    scope = None
+    top = None
+
+    def capture(self):
+        scope = fluid.LOCAL.scope
+        top = self.top
+        if scope is not self.scope or top is None or top.saved or top.eager:
+            top = self.top = fluid.LOCAL.capture()
+            self.scope = scope
+        return top
+
+CAPTURES = captures()
+
+
+### Threads
+
+## A pooled thread is only started once, so the environment it
+## inherits is stale by the time it runs most tasks.  Each task is
+## run in the environment captured when it's submitted instead.
+## Each task branches from the capture, so it localizes cells of its
+## own the first time it uses them (see fluid.inherited).
+
+class capturing(object):
+    """Capture the dynamic environment of the submitter for every
+    task submitted to a multiprocessing pool."""
+
+    def apply_async(self, func, *args, **kwargs):
+        return super(capturing, self).apply_async(
+            self.capture(func), *args, **kwargs
+        )
+
+    def map_async(self, func, *args, **kwargs):
+        return super(capturing, self).map_async(
+            self.capture(func), *args, **kwargs
+        )
+
+    def imap(self, func, *args, **kwargs):
+        return super(capturing, self).imap(
+            self.capture(func), *args, **kwargs
+        )
+
+    def imap_unordered(self, func, *args, **kwargs):
+        return super(capturing, self).imap_unordered(
+            self.capture(func), *args, **kwargs
+        )
+
+class ThreadPool(capturing, pool.ThreadPool):
+    capture = staticmethod(bound)
+
+
+### Processes
+
+## Cells can't be pickled, so cells are identified by id().  This
+## only works for cells created before the worker processes are
+## forked.
+
+class environment(object):
+    """The picklable values of the cells in a dynamic environment."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def bindings(self):
+        cells = known_cells()
+        return [
+            (cells[key], pickle.loads(data))
+            for (key, data) in self.values.iteritems()
+            if key in cells
+        ]
+
+class task(object):
+    """Call a procedure in a captured environment in another
+    process."""
+
+    def __init__(self, proc, env):
+        self.proc = proc
+        self.env = env
+
+    def __call__(self, *args, **kwargs):
+        with fluid.let(*self.env.bindings()):
+            return self.proc(*args, **kwargs)
+
+class snapshots(threading.local):
+    """Capture the values of the cells in the current dynamic
+    environment.  Values are read without localizing inherited cells.
+    The last environment captured by this thread is reused if the
+    pickled values are the same."""
+
+    values = {}
+    data = {}
+    env = None
+
+    def capture(self):
+        values = dict(
+            (id(c), v)
+            for (c, v) in fluid.LOCAL.values().iteritems()
+            if not isinstance(c, fluid.private)
+        )
+        data = dumps(values, self.values, self.data)
+        if self.env is None or data != self.data:
+            self.env = environment(data)
+        (self.values, self.data) = (values, data)
+        return self.env
+
+## Any other value may have been changed in place since it was last
+## pickled.
+ATOMIC = frozenset([
+    type(None), bool, int, long, float, complex, str, unicode
+])
+
+def dumps(values, orig, data):
+    ## Values that can't be pickled (e.g. an stm memory) are left to
+    ## the worker's own environment.  An atomic value that was
+    ## pickled last time isn't pickled again.
+    result = {}
+    for (key, value) in values.iteritems():
+        if value is fluid.UNDEFINED:
+            continue
+        elif (type(value) in ATOMIC and key in data
+              and orig.get(key, fluid.UNDEFINED) is value):
+            result[key] = data[key]
+            continue
+        try:
+            result[key] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+    return result
+
+CELLS = (None, 0, {})
+
+def known_cells():
+    global CELLS
+    (pid, count, cells) = CELLS
+    if pid != os.getpid() or count != len(fluid.GLOBAL):
+        cells = dict((id(c), c) for c in fluid.GLOBAL.keys())
+        CELLS = (os.getpid(), len(fluid.GLOBAL), cells)
+    return cells
+
+class Pool(capturing, pool.Pool):
+    """A process pool that runs each task with the values of the
+    submitter's shared, acquired, and copied cells."""
+
+    def __init__(self, *args, **kwargs):
+        self.snapshots = snapshots()
+        super(Pool, self).__init__(*args, **kwargs)
+
+    def capture(self, func):
+        return task(func, self.snapshots.capture())
+
+
+### Futures
+
+if futures is not None:
+    __all__ += ('ThreadPoolExecutor', 'ProcessPoolExecutor')
+
+    class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            return super(ThreadPoolExecutor, self).submit(
+                bound(fn), *args, **kwargs
+            )
+
+    class ProcessPoolExecutor(futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            self.snapshots = snapshots()
+            super(ProcessPoolExecutor, self).__init__(*args, **kwargs)
+
+        def submit(self, fn, *args, **kwargs):
+            return super(ProcessPoolExecutor, self).submit(
+                task(fn, self.snapshots.capture()), *args, **kwargs
+            )
@@ -1,13 +1,22 @@
 from __future__ import absolute_import
-import threading, copy
-from weakref import WeakKeyDictionary
+import os, threading, copy
+from weakref import WeakKeyDictionary, WeakSet
 from contextlib import contextmanager
 from abc import ABCMeta, abstractmethod
 
+try:
+    from contextvars import ContextVar, copy_context
+    NATIVE_CONTEXTVARS = True
+except ImportError:
+    from ._contextvars import ContextVar, copy_context
+    NATIVE_CONTEXTVARS = False
+
 __all__ = (
     'cell', 'let', 'accessor',
     'shared', 'acquired', 'copied', 'deepcopied', 'private',
-    'FluidError'
+    'FluidError', 'use_backend', 'copy_context',
+    'install', 'uninstall', 'installed', 'stats', 'compact',
+    'inherit'
 )
 
 class UNDEFINED(object): pass
@@ -19,18 +28,28 @@ def cell(value=UNDEFINED, validate=None, type=None):
 def let(*bindings):
     return LOCAL.bind(*bindings)
 
-def accessor(cell, name=None):
+def accessor(cell, name=None, missing=None):
     """Decorate an accessor procedure to raise a ValueError if it
-    returns default."""
+    returns default.  If missing is given, it's called instead.
+
+    Each scope caches the locations of the cells used in it, so
+    accessing a cell again in the same scope is a single lookup.
+    """
+
+    env = cell.ENV
 
     def access(*value):
         if value:
-            return cell.let(*value)
-        else:
-            value = cell.get()
-            if value is UNDEFINED:
-                raise ValueError('%s is undefined' % (name or cell))
-            return value
+            return env.bind((cell, value[0]))
+        loc = env.scope.located.get(cell)
+        if loc is None:
+            loc = env.locate(cell)
+        value = loc.value
+        if value is UNDEFINED:
+            if missing is not None:
+                return missing()
+            raise ValueError('%s is undefined' % (name or cell))
+        return value
 
     return access
 
@@ -46,71 +65,284 @@ class location(object):
     def __init__(self, value):
         self.value = value
 
-class env(threading.local):
+class stamped(location):
+    """A location that remembers when its value was set, so it can
+    be copied on write (see env.preserve())."""
+
+    __slots__ = ('stamp',)
+
+    def __init__(self, value, stamp):
+        self.value = value
+        self.stamp = stamp
+
+class scope(object):
+    """A dynamic context.  A scope is never changed once it's made.
+
+    The frame maps the cells bound by one let() to their locations.
+    The bindings map every cell bound by this scope or its parents to
+    its current location, so a cell is located in constant time no
+    matter how deeply scopes are nested.  Cells not in the bindings
+    are found in the bindings inherited from the parent thread (see
+    inherited) or the global frame.  The location found for each cell
+    is cached in located; since a scope never changes, neither does
+    the location of a cell.
+    """
+
+    __slots__ = (
+        'parent', 'frame', 'bindings', 'inherited', 'located', 'depth'
+    )
+
+    def __init__(self, parent, frame, inherited=None):
+        self.parent = parent
+        self.frame = frame
+        self.located = {}
+        if parent is None:
+            self.bindings = dict(frame)
+            self.inherited = EMPTY if inherited is None else inherited
+            self.depth = 0
+        else:
+            self.bindings = dict(parent.bindings)
+            self.bindings.update(frame)
+            self.inherited = parent.inherited
+            self.depth = parent.depth + 1
+
+    def __repr__(self):
+        return '<%s %d: %d bindings>' % (
+            type(self).__name__, self.depth, len(self.bindings)
+        )
+
+## The inherited bindings of a thread that wasn't started by a Thread.
+EMPTY = {}
+
+class inherited(object):
+    """The bindings a new thread inherits from its parent.
+
+    Starting a thread only captures a reference to the parent's
+    current bindings, which never change.  Each cell is localized
+    (see Cell.localize()) the first time the new thread locates it,
+    so starting a thread takes constant time no matter how many cells
+    are bound.  The value localized is still the value the cell had
+    when the thread was started: copied cells are localized right
+    away (see env.capture()), and the parent saves the value of an
+    acquired cell here before changing it (see env.preserve()).
+    """
+
+    __slots__ = (
+        '__weakref__', 'global_frame', 'bindings', 'parent', 'located',
+        'epoch', 'saved', 'eager'
+    )
+
+    def __init__(self, env, scope, epoch):
+        self.global_frame = env._global
+        self.bindings = scope.bindings
+        self.parent = scope.inherited
+        self.located = env.frame()
+        self.epoch = epoch
+        self.saved = {}
+        self.eager = ()
+
+    def __repr__(self):
+        return '<%s %d bindings: %d located>' % (
+            type(self).__name__, len(self.bindings), len(self.located)
+        )
+
+    def get(self, cell):
+        result = self.located.get(cell)
+        if result is None:
+            result = self.localize(cell)
+        return result
+
+    def localize(self, cell):
+        loc = self.bindings.get(cell)
+        if loc is None:
+            loc = self.parent.get(cell)
+            if loc is None:
+                loc = self.global_frame.get(cell)
+                if loc is None:
+                    return None
+        if type(loc) is stamped:
+            ## Read the value before looking for a saved one; the
+            ## parent saves the old value before it sets a new one.
+            value = loc.value
+            loc = location(self.saved.get(loc, value))
+        result = cell.localize(loc)
+        if result is NotImplemented:
+            result = self.global_frame[cell]
+        elif type(result) is stamped:
+            ## The value is as old as this capture, so threads started
+            ## since may need it saved.
+            result.stamp = self.epoch
+        ## Threads started by the new thread may localize its
+        ## inherited bindings too.  Only the first location stored is
+        ## used.
+        return self.located.setdefault(cell, result)
+
+    def origin(self, cell):
+        """Return the location cell would be localized from (or its
+        location if it's been localized) without localizing it."""
+
+        loc = self.located.get(cell)
+        if loc is not None:
+            return loc
+        loc = self.bindings.get(cell)
+        if loc is None and self.parent is not EMPTY:
+            loc = self.parent.origin(cell)
+        if loc is None:
+            loc = self.global_frame.get(cell)
+            if loc is None:
+                return None
+        if type(loc) is stamped:
+            value = loc.value
+            loc = location(self.saved.get(loc, value))
+        return loc
+
+    def items(self):
+        """Return (cell, location) items for every inherited binding
+        without localizing them (see origin())."""
+
+        cells = set()
+        bindings = self
+        while bindings is not EMPTY:
+            cells.update(bindings.located)
+            cells.update(bindings.bindings)
+            bindings = bindings.parent
+        return [(c, self.origin(c)) for c in cells]
+
+class env(object):
     FrameType = WeakKeyDictionary
 
-    def __init__(self, global_frame, make_top):
-        """Initialize the local environment for this thread.  The
-        make_top procedure must return a single frame."""
+    ## A scope's cache of located cells holds the cells strongly.  It's
+    ## cleared when it reaches this size so that the top scope of a
+    ## long-running thread doesn't keep every cell it has ever used
+    ## alive.
+    LOCATED_LIMIT = 1024
+
+    misses = 0
+    compactions = 0
+
+    def __init__(self, global_frame, make_top, state=None):
+        """Initialize the dynamic environment.  The make_top
+        procedure must return a single frame (or inherited bindings);
+        it's called to make the top scope of each new thread (or
+        context).  The state keeps track of the current scope (see
+        threadstate)."""
 
         self._global = global_frame
-        self.reset(make_top(self))
+        self.make_top = make_top
+        self.state = state or threadstate()
+        self.eager = WeakKeyDictionary()
+        self.epoch = 0
+        self.captures = WeakSet()
+        self.capturing = threading.Lock()
+
+    @property
+    def scope(self):
+        scope = self.state.get()
+        if scope is None:
+            scope = self.reset(self.make_top(self))
+        return scope
+
+    @scope.setter
+    def scope(self, scope):
+        self.state.set(scope)
+
+    @property
+    def frames(self):
+        """The global frame and the frame of each scope, innermost
+        last."""
+
+        frames = []
+        probe = self.scope
+        while probe is not None:
+            frames.append(probe.frame)
+            probe = probe.parent
+        frames.append(self._global)
+        frames.reverse()
+        return frames
 
     def define(self, cell, location):
         result = self._global.setdefault(cell, location)
         if result is not location:
             raise FluidError('already defined', cell, result)
+        if cell.EAGER:
+            self.eager[cell] = True
         return result
 
     def locate(self, cell):
-        """Return the value bound to cell in the current context."""
+        """Return the location bound to cell in the current context."""
 
-        frame = self.frames[-1]
-        try:
-            ## Quickly look in the current frame.
-            return frame[cell]
-        except KeyError:
-            ## Fall back on _find()
-            result = frame[cell] = self._find(len(self.frames) - 2, cell)
-        if not result:
-            raise FluidError('locate: unbound cell', cell)
+        scope = self.scope
+        result = scope.located.get(cell)
+        if result is None:
+            result = self.resolve(scope, cell)
         return result
 
-    def _find(self, index, cell):
-        """Search through the frames for cell, memoizing the result in
-        each frame if the next frame must be searched.."""
-
-        if index < 0:
-            return None
-        frame = self.frames[index]
-        try:
-            return frame[cell]
-        except KeyError:
-            result = frame[cell] = self._find(index - 1, cell)
+    def resolve(self, scope, cell):
+        result = scope.bindings.get(cell)
+        if result is None:
+            result = scope.inherited.get(cell)
+            if result is None:
+                result = self._global.get(cell)
+                if result is None:
+                    raise FluidError('locate: unbound cell', cell)
+        located = scope.located
+        if len(located) >= self.LOCATED_LIMIT:
+            located.clear()
+            self.compactions += 1
+        located[cell] = result
+        self.misses += 1
         return result
 
+    def compact(self):
+        """Clear the caches of located cells in the current scope and
+        its parents.  Return the number of entries removed."""
+
+        removed = 0
+        probe = self.scope
+        while probe is not None:
+            removed += len(probe.located)
+            probe.located.clear()
+            probe = probe.parent
+        self.compactions += 1
+        return removed
+
+    def stats(self):
+        """Return a dictionary of statistics about the current scope.
+        The misses and compactions are counted for every thread."""
+
+        scope = self.scope
+        located = 0
+        probe = scope
+        while probe is not None:
+            located += len(probe.located)
+            probe = probe.parent
+        return dict(
+            depth=scope.depth,
+            bindings=len(scope.bindings),
+            located=located,
+            inherited=len(getattr(scope.inherited, 'located', ())),
+            defined=len(self._global),
+            misses=self.misses,
+            compactions=self.compactions
+        )
+
     def push(self, frame):
         """Push a frame onto the stack."""
 
-        self.frames.append(frame)
+        self.scope = scope(self.scope, frame)
 
     def pop(self):
         """Pop the last from pushed onto the stack."""
 
-        if len(self.frames) < 1:
+        if self.scope.parent is None:
             raise FluidError('Cannot pop() the global frame.')
-        self.frames.pop()
+        self.scope = self.scope.parent
 
-    @contextmanager
     def bind(self, *bindings):
-        """Dynamically bind bindings in a new context."""
+        """Dynamically bind bindings in a new context.  All of the
+        bindings are made in a single scope."""
 
-        frame = self.frame((c, c.bind(v)) for (c, v) in bindings)
-        self.push(frame)
-        try:
-            yield
-        finally:
-            self.pop()
+        return binding(self, bindings)
 
     @classmethod
     def frame(cls, bindings=()):
@@ -123,45 +355,264 @@ class env(threading.local):
         frame."""
 
         result = self.frame()
-        frames = frames or self.frames
+        if not frames:
+            scope = self.scope
+            frames = (self._global, scope.inherited, scope.bindings)
         index = len(frames) - 1
         while index > -1:
             frame = frames[index]
             index -= 1
-            for cell in frame:
+            for (cell, loc) in frame.items():
                 if cell in result:
                     continue
-                loc = cell.localize(frame[cell])
+                loc = cell.localize(loc)
                 if loc is not NotImplemented:
                     result[cell] = loc
         return result
 
+    def capture(self):
+        """Capture the current bindings for a new thread.  Copied
+        cells are localized now because their values may be changed
+        in place later; the rest are localized by the new thread."""
+
+        scope = self.scope
+        with self.capturing:
+            self.epoch += 1
+            result = inherited(self, scope, self.epoch)
+            self.captures.add(result)
+        cells = set(c for c in scope.bindings if c.EAGER)
+        cells.update(self.eager.keys())
+        cells.update(getattr(scope.inherited, 'eager', ()))
+        for cell in cells:
+            result.located[cell] = cell.localize(self.locate(cell))
+        result.eager = tuple(cells)
+        return result
+
+    def preserve(self, loc):
+        """Copy on write.  Save the current value of a stamped
+        location for each thread captured since the value was set,
+        before it's changed."""
+
+        if loc.stamp < self.epoch:
+            with self.capturing:
+                epoch = self.epoch
+                pending = [c for c in self.captures if c.epoch > loc.stamp]
+            for captured in pending:
+                captured.saved.setdefault(loc, loc.value)
+            loc.stamp = epoch
+
+    @contextmanager
+    def installed(self, top):
+        """Use captured bindings (or a frame) as the dynamic
+        environment for the extent of the context."""
+
+        saved = self.scope
+        self.reset(top)
+        try:
+            yield
+        finally:
+            self.scope = saved
+
+    def branch(self, top):
+        """Return bindings inherited from captured bindings.  Each
+        branch localizes cells of its own, so one capture can be
+        shared by many tasks."""
+
+        result = inherited(self, scope(None, {}, top), self.epoch)
+        result.eager = top.eager
+        return result
+
+    def values(self):
+        """Return a dictionary that maps every cell to its current
+        value.  Inherited cells aren't localized."""
+
+        scope = self.scope
+        bindings = scope.bindings
+        inherited = scope.inherited
+        result = {}
+        for (cell, loc) in self._global.items():
+            probe = bindings.get(cell)
+            if probe is not None:
+                result[cell] = probe.value
+            elif inherited is EMPTY:
+                result[cell] = loc.value
+            else:
+                result[cell] = inherited.origin(cell).value
+        return result
+
     def reset(self, top):
-        """Reset the dynamic environment."""
+        """Reset the dynamic environment.  The top is a frame or
+        bindings inherited from another thread."""
+
+        if isinstance(top, inherited):
+            self.scope = top = scope(None, {}, top)
+        else:
+            self.scope = top = scope(None, top)
+        return top
+
+
+class binding(object):
+    """The context made by env.bind()."""
+
+    __slots__ = ('env', 'bindings', 'saved')
+
+    def __init__(self, env, bindings):
+        self.env = env
+        self.bindings = bindings
+
+    def __enter__(self):
+        env = self.env
+        self.saved = saved = env.scope
+        env.scope = scope(
+            saved,
+            dict((c, c.bind(v)) for (c, v) in self.bindings)
+        )
+
+    def __exit__(self, *exc):
+        self.env.scope = self.saved
+
+
+### Backends
+
+class threadstate(threading.local):
+    """Keep the current scope in a thread-local.  Every thread has
+    its own dynamic environment."""
+
+    current = None
+
+    def get(self):
+        return self.current
+
+    def set(self, scope):
+        self.current = scope
+
+class contextstate(object):
+    """Keep the current scope in a context variable.  Each asyncio
+    task (or any procedure called with Context.run()) has its own
+    dynamic environment.  A new task starts with the scope of the
+    task that created it; scopes are never changed, so this is safe
+    and cheap."""
+
+    def __init__(self):
+        self.var = ContextVar('md.fluid.scope', default=None)
+
+    def get(self):
+        return self.var.get()
+
+    def set(self, scope):
+        self.var.set(scope)
+
+class greenletstate(object):
+    """Keep the current scope on the current greenlet.  Every greenlet
+    has its own dynamic environment.  A greenlet starts with the
+    environment of its thread unless inherit() is used to give it the
+    environment of the greenlet that spawned it."""
+
+    def __init__(self):
+        ## Imported here so md.fluid doesn't load greenlet unless the
+        ## backend is used.
+        try:
+            from greenlet import getcurrent
+        except ImportError:
+            raise FluidError('The greenlet module is not available.')
+        self.getcurrent = getcurrent
+
+    def get(self):
+        return getattr(self.getcurrent(), 'fluid_scope', None)
+
+    def set(self, scope):
+        self.getcurrent().fluid_scope = scope
+
+BACKENDS = {
+    'thread': threadstate,
+    'context': contextstate,
+    'greenlet': greenletstate
+}
+
+def use_backend(name):
+    """Keep the dynamic environment of the current thread and every
+    new thread in thread-local storage ('thread'), in a context
+    variable ('context'), or on each greenlet ('greenlet').  The
+    current bindings are kept."""
+
+    current = LOCAL.scope
+    LOCAL.state = BACKENDS[name]()
+    LOCAL.scope = current
+
+
+def inherit(child):
+    """Give a greenlet that hasn't been started the current dynamic
+    environment (see greenletstate).  Capturing it takes constant
+    time, like starting a Thread.  Return the greenlet.
+
+    For example: inherit(gevent.spawn(proc))
+    """
+
+    child.fluid_scope = scope(None, {}, LOCAL.capture())
+    return child
 
-        self.frames = [self._global, top]
 
-
 ### Thread Integration
 
-MONKEY_PATCH = True
+## The threading module is only patched by install(), or when
+## md.fluid is imported if MD_FLUID_PATCH=1 is set in the environment.
+## Threads made with fluid.Thread always inherit the dynamic
+## environment.
+MONKEY_PATCH = os.environ.get('MD_FLUID_PATCH', '0') != '0'
 
-if MONKEY_PATCH:
-    try:
-        RealThread = threading.RealThread
-    except AttributeError:
-        threading.RealThread = RealThread = threading.Thread
-else:
-    RealThread = threading.Thread
+## The original is kept in the threading module so a reloaded fluid
+## module doesn't subclass its own patch.
+RealThread = getattr(threading, 'RealThread', threading.Thread)
+
+PATCHED = ('_DummyThread', '_Timer')
+
+class threadtype(type):
+    ## Classes that subclassed the original threading.Thread before
+    ## install() (e.g. multiprocessing.dummy.DummyProcess) still call
+    ## threading.Thread.__init__(self), so their instances must pass
+    ## the unbound method's isinstance() check.
+    def __instancecheck__(cls, obj):
+        if cls is Thread:
+            return isinstance(obj, RealThread)
+        return type.__instancecheck__(cls, obj)
 
 class Thread(RealThread):
     """Capture the current dynamic environment before running a new
     thread."""
 
+    __metaclass__ = threadtype
+
     def start(self):
-        self.localized = LOCAL.localize()
+        self.localized = LOCAL.capture()
         RealThread.start(self)
 
+def install():
+    """Replace threading.Thread (and its internal subclasses) so every
+    new thread inherits the dynamic environment of its parent."""
+
+    if not hasattr(threading, 'RealThread'):
+        threading.RealThread = RealThread
+        threading.Thread = Thread
+    for name in PATCHED:
+        patch_subclass(name)
+
+def uninstall():
+    """Restore the original threading.Thread."""
+
+    try:
+        threading.Thread = threading.RealThread
+        del threading.RealThread
+    except AttributeError:
+        pass
+    for name in PATCHED:
+        orig = getattr(threading, 'Real%s' % name, None)
+        if orig is not None:
+            setattr(threading, name, orig)
+            delattr(threading, 'Real%s' % name)
+
+def installed():
+    return hasattr(threading, 'RealThread')
+
 def patch_subclass(name):
     new = 'Real%s' % name
     try:
@@ -172,9 +623,7 @@ def patch_subclass(name):
         setattr(threading, name, type(name, (Thread, orig), {}))
 
 if MONKEY_PATCH:
-    threading.Thread = Thread
-    patch_subclass('_DummyThread')
-    patch_subclass('_Timer')
+    install()
 
 def parent_environment(missing):
     t = threading.currentThread()
@@ -185,12 +634,26 @@ def parent_environment(missing):
     return frame
 
 GLOBAL = env.FrameType()
-LOCAL = env(GLOBAL, lambda e: parent_environment(e.frame))
+LOCAL = env(
+    GLOBAL,
+    lambda e: parent_environment(e.frame),
+    BACKENDS['context' if NATIVE_CONTEXTVARS else 'thread']()
+)
 
 def reset():
     top = parent_environment(LOCAL.frame)
     LOCAL.reset(LOCAL.localize(GLOBAL, top))
 
+def stats():
+    """Return statistics about the current dynamic environment."""
+
+    return LOCAL.stats()
+
+def compact():
+    """Release the cells cached by the current dynamic environment."""
+
+    return LOCAL.compact()
+
 
 ### Cells
 
@@ -203,6 +666,10 @@ class Cell(object):
 
     ENV = LOCAL
 
+    ## Eager cells are localized when a thread is started instead of
+    ## when the thread first uses them (see env.capture()).
+    EAGER = False
+
     def __init__(self, value=UNDEFINED, validate=None):
         self.validate = validate or identity
         if value is not UNDEFINED:
@@ -242,10 +709,22 @@ class acquired(Cell):
     def localize(self, loc):
         return self.make_location(loc.value)
 
+    def make_location(self, value):
+        return stamped(value, self.ENV.epoch)
+
+    def set(self, value):
+        loc = self.ENV.locate(self)
+        self.ENV.preserve(loc)
+        loc.value = self.validate(value)
+
 class copied(Cell):
+    EAGER = True
+
     def localize(self, loc):
         return self.make_location(copy.copy(loc.value))
 
 class deepcopied(Cell):
+    EAGER = True
+
     def localize(self, loc):
         return self.make_location(copy.deepcopy(loc.value))
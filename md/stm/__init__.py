@@ -3,5 +3,7 @@ from .transaction import *
 from .interfaces import *
 from .cursor import *
 from .journal import *
-
-initialize()
+from .view import *
+from .index import *
+from .profile import *
+from .export import *
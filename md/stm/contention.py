@@ -0,0 +1,232 @@
+from __future__ import absolute_import
+import threading, time
+from thread import get_ident
+from contextlib import contextmanager
+from .. import fluid
+from .interfaces import CannotCommit
+from .log import weaklog
+
+__all__ = ('hotspots', 'manager', 'ticket')
+
+class hotspot(object):
+    __slots__ = ('score', 'lock', 'thread')
+
+    def __init__(self):
+        self.score = 0
+        self.lock = None
+        self.thread = None
+
+class hotspots(object):
+    """Track how often cursors are involved in conflicts and switch
+    the hottest ones to pessimistic locking.
+
+    Each conflict adds one to a cursor's score and each successful
+    commit that writes the cursor multiplies it by decay.  A cursor
+    with a score of at least threshold is hot: a journal must lock it
+    before reading or writing it, so concurrent writers queue up
+    instead of failing to commit.  Waiting for the lock also adds to the score,
+    so a hot cursor stays hot while it is contended.  When the score
+    falls below 1, the cursor is optimistic again.  Set threshold to
+    None to disable locking.
+
+    To avoid deadlock, a journal that already holds a lock never
+    waits for another one while holding it.  Its locks are released
+    and a CannotCommit exception is raised so the transaction can be
+    retried.
+    """
+
+    def __init__(self, threshold=3, decay=0.9):
+        self.threshold = threshold
+        self.decay = decay
+        self.spots = weaklog()
+
+    def hot(self, cursor):
+        spot = self.spots.get(cursor)
+        return spot is not None and spot.lock is not None
+
+    def conflicted(self, conflicts):
+        if self.threshold is None:
+            return
+        for (cursor, _) in conflicts:
+            spot = self.spots.setdefault(cursor, hotspot())
+            spot.score += 1
+            if spot.lock is None and spot.score >= self.threshold:
+                spot.lock = threading.Lock()
+
+    def committed(self, changed):
+        if not self.spots.entries:
+            return
+        for (cursor, _) in changed:
+            spot = self.spots.get(cursor)
+            if spot is not None:
+                spot.score *= self.decay
+                if spot.score < 1:
+                    ## Writers already waiting on the lock still get
+                    ## it; new writers don't need it.
+                    spot.lock = None
+                if spot.score < 0.1:
+                    del self.spots[cursor]
+
+    def acquire(self, journal, cursor):
+        """Lock cursor on behalf of journal if cursor is hot."""
+
+        if not self.spots.entries:
+            return
+        spot = self.spots.get(cursor)
+        if spot is None or spot.lock is None:
+            return
+        lock = spot.lock
+        if lock in journal.locks:
+            return
+        if not lock.acquire(False):
+            spot.score += 1
+            if spot.thread == get_ident():
+                raise CannotCommit([(cursor, None)])
+            elif journal.locks:
+                ## Give up held locks and wait for this one to be
+                ## free before retrying.  Retrying immediately tends
+                ## to livelock.
+                self.release(journal)
+                lock.acquire(); lock.release()
+                raise CannotCommit([(cursor, None)])
+            lock.acquire()
+        spot.thread = get_ident()
+        journal.locks.append(lock)
+
+    def release(self, journal):
+        """Release any locks held by journal."""
+
+        for lock in journal.locks:
+            lock.release()
+        del journal.locks[:]
+
+
+### Priority
+
+class ticket(object):
+    """A transaction's place in line while it is being retried by
+    transactionally().  Priority grows with the number of retries;
+    between equal retries, the older ticket wins."""
+
+    def __init__(self, manager=None):
+        self.manager = manager
+        self.retries = 0
+        self.started = time.time()
+        self.access = ()
+
+    @property
+    def priority(self):
+        return (self.retries, -self.started)
+
+    @contextmanager
+    def attempt(self):
+        manager = self.manager
+        starving = (
+            manager is not None
+            and self.retries >= manager.patience
+            and self.access
+        )
+        if starving:
+            manager.reserve(self)
+        try:
+            yield self
+        except CannotCommit:
+            self.retries += 1
+            raise
+        finally:
+            if starving:
+                manager.release(self)
+
+class manager(object):
+    """Arbitrate between transactions retried by transactionally() so
+    that large transactions are not starved by small ones.
+
+    Once a transaction has been retried patience times, it is
+    starving.  Before its next attempt, it waits until it is the
+    highest priority starving transaction and then reserves every
+    cursor its last failed attempt read or wrote.  Other transactions
+    wait before writing a reserved cursor (or fail if they already
+    hold locks), and commits that change a reserved cursor fail.  The
+    reservation is released when the attempt is finished.
+
+    Tickets are bound in the dynamic environment, so each context
+    (e.g. a greenlet) contends on its own, like an irrevocable
+    transaction.
+    """
+
+    def __init__(self, patience=2):
+        self.patience = patience
+        self.local = fluid.cell(None, type=fluid.private)
+        self.cond = threading.Condition(threading.Lock())
+        self.starving = []
+        self.holder = None
+        self.reserved = frozenset()
+
+    def current(self):
+        return self.local.value
+
+    @contextmanager
+    def contending(self):
+        """Issue a ticket for the current thread."""
+
+        issued = self.current()
+        if issued is not None:
+            yield issued
+            return
+        issued = ticket(self)
+        with self.local.let(issued):
+            yield issued
+
+    def reserve(self, ticket):
+        with self.cond:
+            self.starving.append(ticket)
+            while (self.holder is not None
+                   or highest(self.starving) is not ticket):
+                self.cond.wait()
+            self.starving.remove(ticket)
+            self.holder = ticket
+            self.reserved = frozenset(c.__id__ for c in ticket.access)
+
+    def release(self, ticket):
+        with self.cond:
+            if self.holder is ticket:
+                self.holder = None
+                self.reserved = frozenset()
+                self.cond.notify_all()
+
+    def conflicted(self, trans):
+        """Remember what a failed top-level journal accessed."""
+
+        ticket = self.current()
+        if ticket is not None:
+            ticket.access = (
+                [c for (c, _) in trans.original()]
+                + [c.cursor for c in trans.changed()]
+            )
+
+    def claim(self, journal, cursor):
+        """Wait for cursor to be unreserved before journal writes it."""
+
+        if not self.reserved or cursor.__id__ not in self.reserved:
+            return
+        with self.cond:
+            while cursor.__id__ in self.reserved:
+                if self.holder is self.current():
+                    return
+                elif journal.locks:
+                    raise CannotCommit([(cursor, None)])
+                self.cond.wait()
+
+    def verify(self, changed):
+        """Raise CannotCommit if changed includes a cursor reserved by
+        another transaction."""
+
+        reserved = self.reserved
+        if not reserved or self.holder is self.current():
+            return
+        conflicts = [(c, s) for (c, s) in changed if c.__id__ in reserved]
+        if conflicts:
+            raise CannotCommit(conflicts)
+
+def highest(tickets):
+    return max(tickets, key=lambda t: t.priority)
@@ -1,12 +1,18 @@
 from __future__ import absolute_import
-import copy
+import copy, threading
+from operator import attrgetter
 from .. import abc
 from ..prelude import *
+from ..collections import frame_module
 from .interfaces import Cursor
-from .transaction import allocate, readable, writable
-from .journal import copy_state
+from .transaction import (
+    allocate, readable, writable, current_journal, current_memory
+)
+from .journal import copy_state, is_written
 
-__all__ = ('cursor', 'dict', 'tree', 'omap', 'list', 'set')
+__all__ = (
+    'cursor', 'record', 'dict', 'tree', 'omap', 'list', 'listview', 'set'
+)
 
 _dict = dict
 _list = list
@@ -70,6 +76,83 @@ class cursor(_cursor):
         except KeyError:
             raise AttributeError, key
 
+
+### Records
+
+## Most fields hold atomic values, which don't need to be copied when
+## a record's state is made writable.
+ATOMIC = frozenset([
+    type(None), bool, int, long, float, complex, str, unicode
+])
+
+def _copy_record_state(self, memo):
+    return type(self)(*[
+        v if type(v) in ATOMIC else copy.deepcopy(v, memo)
+        for v in self
+    ])
+
+def _reduce_record_state(self):
+    return (_record_state, (self.record, tuple(self)))
+
+def _record_state(cls, values):
+    return cls.StateType(*values)
+
+class RecordType(type):
+    """Give each record class its own state type so that states can
+    be pickled by a reference to the record class."""
+
+    def __new__(mcls, name, bases, attr):
+        attr.setdefault('__slots__', ())
+        cls = type.__new__(mcls, name, bases, attr)
+        base = cls.StateType
+        cls.StateType = type(base)(base.__name__, (base, ), {
+            'record': cls,
+            '__deepcopy__': _copy_record_state,
+            '__reduce__': _reduce_record_state
+        })
+        return cls
+
+class _record(_cursor):
+    __metaclass__ = RecordType
+    StateType = struct('record_state', ())
+
+    def __new__(cls, *args, **kwargs):
+        state = cls.StateType(*_fields(cls.StateType.__all__, args, kwargs))
+        return allocated(cls, state)
+
+def record(name, fields):
+    """Create a cursor class called name with the given fields.  Its
+    state is a struct (see md.collections.struct) instead of a dict,
+    and each field has a generated accessor."""
+
+    state = struct('%s_state' % name, fields)
+    attr = _dict((f, _field(f)) for f in state.__all__)
+    attr['StateType'] = state
+    attr['__module__'] = frame_module(1)
+    return RecordType(name, (_record, ), attr)
+
+def _field(name):
+    get = attrgetter(name)
+
+    def fget(self):
+        return get(readable(self))
+
+    def fset(self, value):
+        setattr(writable(self), name, value)
+
+    return property(fget, fset)
+
+def _fields(names, args, kwargs):
+    if len(args) > len(names):
+        raise TypeError('Expected at most %d arguments.' % len(names))
+    values = _list(args) + [None] * (len(names) - len(args))
+    for (key, value) in kwargs.iteritems():
+        try:
+            values[names.index(key)] = value
+        except ValueError:
+            raise TypeError('Unexpected keyword argument %r.' % key)
+    return values
+
 
 ### Collections
 
@@ -128,7 +211,10 @@ class list(_collection):
             self.extend(seq)
 
     def __getslice__(self, i, j):
-        return allocated(type(self), readable(self).__getslice__(i, j))
+        state = readable(self)
+        if is_written(current_journal(), self):
+            return listview(state[i:j], kind=type(self))
+        return listview(state, i, j, type(self))
 
     def __setslice__(self, i, j, other):
         return writable(self).__setslice__(i, j, self._coerce(other))
@@ -137,7 +223,7 @@ class list(_collection):
         return writable(self).__delslice__(i, j)
 
     def __add__(self, other):
-        return allocated(type(self), readable(self) + self._coerce(other))
+        return listview(readable(self) + self._coerce(other), kind=type(self))
 
     __radd__ = __add__
 
@@ -145,7 +231,7 @@ class list(_collection):
         return writable(self).__iadd__(self._coerce(other))
 
     def __mul__(self, n):
-        return allocated(type(self), readable(self) * n)
+        return listview(readable(self) * n, kind=type(self))
 
     __rmul__ = __mul__
 
@@ -190,12 +276,195 @@ class list(_collection):
     def extend(self, other):
         return writable(self).extend(self._cast(other))
 
+## Only one list is allocated for a view, even if several threads
+## change it at once.
+ALLOCATING = threading.Lock()
+
+@abc.implements(MutableSequence)
+class listview(object):
+    """A view of a range of the items in a list's state.
+
+    Slicing, adding, or multiplying a list produces a view instead of
+    allocating a new list cursor.  A view of a committed state shares
+    it without copying, since committed states are never changed.
+    The first change made through a view allocates a list (of kind)
+    with a copy of the items; after that, the view is a proxy for the
+    new list.
+
+    A view may itself be part of a committed state, so the new list
+    is allocated in the memory rather than the current transaction.
+    It holds the same items as the view did, so allocating it doesn't
+    change what anyone sees; the change is made to the new list in
+    the current transaction.
+    """
+
+    __slots__ = ('_data', '_start', '_stop', '_kind', '_list')
+
+    def __init__(self, data, start=0, stop=None, kind=list):
+        (start, stop, _) = slice(start, stop).indices(len(data))
+        self._data = data
+        self._start = start
+        self._stop = max(start, stop)
+        self._kind = kind
+        self._list = None
+
+    def _range(self):
+        ## Data is cleared after the list is set (see _writable()).
+        data = self._data
+        if self._list is None:
+            return (data, self._start, self._stop)
+        state = readable(self._list)
+        return (state, 0, len(state))
+
+    def _items(self):
+        (data, start, stop) = self._range()
+        return data[start:stop]
+
+    def _writable(self):
+        if self._list is None:
+            state = self._kind.StateType(self._items())
+            with ALLOCATING:
+                if self._list is None:
+                    self._list = current_memory().allocate(
+                        object.__new__(self._kind), state
+                    )
+                    self._data = None
+        return self._list
+
+    def __copy__(self):
+        (data, start, stop) = self._range()
+        return type(self)(data, start, stop, self._kind)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (allocated, (self._kind, self._items()))
+
+    def __repr__(self):
+        return '%s(%r)' % (self._kind.__name__, self._items())
+
+    ## Reading
+
+    def __len__(self):
+        (data, start, stop) = self._range()
+        return stop - start
+
+    def __iter__(self):
+        (data, start, stop) = self._range()
+        return (data[i] for i in xrange(start, stop))
+
+    def __contains__(self, item):
+        return any(x == item for x in self)
+
+    def __getitem__(self, i):
+        (data, start, stop) = self._range()
+        if isinstance(i, slice):
+            return type(self)(self._items()[i], kind=self._kind)
+        elif i < 0:
+            i += stop - start
+        if not 0 <= i < stop - start:
+            raise IndexError('list index out of range')
+        return data[start + i]
+
+    def __getslice__(self, i, j):
+        (data, start, stop) = self._range()
+        (i, j, _) = slice(i, j).indices(stop - start)
+        return type(self)(data, start + i, start + max(i, j), self._kind)
+
+    def __add__(self, other):
+        return type(self)(self._items() + _list(other), kind=self._kind)
+
+    def __radd__(self, other):
+        return type(self)(_list(other) + self._items(), kind=self._kind)
+
+    def __mul__(self, n):
+        return type(self)(self._items() * n, kind=self._kind)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return self._items() == _items(other)
+
+    def __ne__(self, other):
+        return self._items() != _items(other)
+
+    def __lt__(self, other):
+        return self._items() < _items(other)
+
+    def __le__(self, other):
+        return self._items() <= _items(other)
+
+    def __gt__(self, other):
+        return self._items() > _items(other)
+
+    def __ge__(self, other):
+        return self._items() >= _items(other)
+
+    __hash__ = None
+
+    def count(self, item):
+        return sum(1 for x in self if x == item)
+
+    def index(self, item, *args):
+        return self._items().index(item, *args)
+
+    ## Writing
+
+    def __setitem__(self, i, item):
+        self._writable()[i] = item
+
+    def __delitem__(self, i):
+        del self._writable()[i]
+
+    def __setslice__(self, i, j, other):
+        self._writable()[i:j] = other
+
+    def __delslice__(self, i, j):
+        del self._writable()[i:j]
+
+    def __iadd__(self, other):
+        self._writable().extend(other)
+        return self
+
+    def __imul__(self, n):
+        self._writable().__imul__(n)
+        return self
+
+    def append(self, item):
+        return self._writable().append(item)
+
+    def extend(self, other):
+        return self._writable().extend(other)
+
+    def insert(self, i, item):
+        return self._writable().insert(i, item)
+
+    def pop(self, i=-1):
+        return self._writable().pop(i)
+
+    def remove(self, item):
+        return self._writable().remove(item)
+
+    def reverse(self):
+        return self._writable().reverse()
+
+    def sort(self, *args, **kwargs):
+        return self._writable().sort(*args, **kwargs)
+
+def _items(seq):
+    if isinstance(seq, listview):
+        return seq._items()
+    elif isinstance(seq, list):
+        return readable(seq)
+    return seq
+
 @abc.implements(MutableMapping)
 class dict(_collection):
 
     def __init__(self, dict=None, **kwargs):
         if dict is not None or kwargs:
-            self.update(dict, kwargs)
+            self.update(dict, **kwargs)
 
     def __repr__(self):
         data = readable(self)
@@ -260,7 +529,7 @@ class dict(_collection):
 
     def update(self, dict=None, **kwargs):
         if dict or kwargs:
-            writable(self).update(dict, **kwargs)
+            writable(self).update(dict or (), **kwargs)
 
     def values(self):
         return readable(self).values()
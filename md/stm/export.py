@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+import array
+from ..prelude import Undefined
+from .transaction import current_memory
+
+__all__ = ('columns', )
+
+def columns(kind, fields, dtypes=None, mem=None):
+    """Gather fields from the committed states of every cursor of kind
+    into columns.
+
+    Return a list of cursors and a dictionary that maps each field to
+    a column of values, one per cursor.  Missing fields are None.  The
+    values are collected in one pass over a consistent snapshot (see
+    memory.snapshot()).  Columns are NumPy arrays if NumPy is
+    available.  Otherwise, they are array.array instances when the
+    values are all numbers, or lists.  The optional dtypes dictionary
+    maps a field to a NumPy dtype (or an array typecode, if NumPy is
+    not available).
+    """
+
+    if isinstance(fields, basestring):
+        fields = fields.split()
+    dtypes = dtypes or {}
+
+    items = (mem or current_memory()).snapshot(kind)
+    cursors = [c for (c, _) in items]
+    values = [[] for _ in fields]
+    for (_, state) in items:
+        get = getter(state)
+        for (field, seq) in zip(fields, values):
+            seq.append(get(field))
+
+    return (cursors, dict(
+        (f, column(v, dtypes.get(f)))
+        for (f, v) in zip(fields, values)
+    ))
+
+def getter(state):
+    if isinstance(state, dict):
+        return state.get
+    return lambda field: getattr(state, field, None)
+
+def column(values, dtype=None):
+    numpy = load_numpy()
+    if numpy is not None:
+        return numpy.array(values, dtype=dtype)
+    code = dtype or typecode(values)
+    return values if code is None else array.array(code, values)
+
+def typecode(values):
+    types = set(type(v) for v in values)
+    if types <= INTEGER:
+        return 'l'
+    elif types <= NUMBER:
+        return 'd'
+    return None
+
+def load_numpy():
+    ## NumPy is slow to import, so wait until it's needed.
+    global NUMPY
+    if NUMPY is Undefined:
+        try:
+            import numpy as NUMPY
+        except ImportError:
+            NUMPY = None
+    return NUMPY
+
+NUMPY = Undefined
+
+INTEGER = frozenset([int, bool])
+NUMBER = frozenset([int, bool, float])
@@ -0,0 +1,269 @@
+from __future__ import absolute_import
+import bisect
+from ..prelude import *
+from .interfaces import Cursor, Memory
+from .journal import Deleted, readable_state
+from .transaction import current_journal
+
+__all__ = ('index', 'sorted_index')
+
+class token(Cursor):
+    """A cursor whose state is a version number.  Queries read tokens
+    so that commits which change their results conflict with the
+    querying transaction."""
+
+    __slots__ = ()
+
+class bucket(object):
+    __slots__ = ('token', 'members')
+
+    def __init__(self):
+        self.token = token()
+        self.members = {}
+
+
+### Hash Index
+
+class index(object):
+    """Map the value of field in the states of cursors to the cursors
+    that have that value.
+
+    The field may be a key in each state (e.g. an attribute of a
+    cursor or a key of a dict) or a procedure that returns the value
+    given a state.  Only instances of kind are indexed.  An index is
+    maintained by a memory as each transaction is committed (see
+    memory.add_index()).  It keeps the cursors it contains alive until
+    they are deleted.
+
+    Each distinct value has a token cursor.  A lookup reads the token
+    of its value, and a commit that adds or removes a cursor from a
+    value writes a new version of the token, so the lookup is
+    validated like any other read when its transaction is committed.
+    """
+
+    def __init__(self, field, kind=None):
+        self.field = field
+        self.kind = kind
+        self.mem = None
+        self.values = {}
+        self.buckets = {}
+        self.absent = token()
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.field)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, value):
+        """Return the cursors whose field is value."""
+
+        journal = current_journal()
+        with self.mem.write_lock:
+            probe = self.buckets.get(value)
+            if probe is None:
+                readable_state(journal, self.absent)
+                members = {}
+            else:
+                readable_state(journal, probe.token)
+                members = dict(probe.members)
+        return self.adjust(journal, members, lambda v: v == value).values()
+
+    ## Maintenance
+
+    def build(self, mem):
+        """Plan indexing the committed states in mem.  Called by
+        memory with its commit lock held."""
+
+        self.mem = mem
+        return self.plan(list(mem.mem), {self.absent: 0})
+
+    def plan(self, changed, tokens=None):
+        """Plan the changes to the index for the changed (cursor,
+        state) items of a commit.  Nothing is changed until the plan
+        is applied, so a commit that fails leaves the index alone."""
+
+        result = changes({} if tokens is None else tokens)
+        touched = {}
+        for (cursor, state) in changed:
+            if not self.covers(cursor):
+                continue
+            value = self.extract(state)
+            orig = self.values.get(cursor.__id__, Undefined)
+            if orig == value:
+                continue
+            if orig is not Undefined:
+                result.removed.append((cursor, orig))
+                touched[orig] = touched.get(orig, 0) - 1
+            if value is not Undefined:
+                result.inserted.append((cursor, value))
+                touched[value] = touched.get(value, 0) + 1
+
+        for (value, delta) in touched.iteritems():
+            probe = self.buckets.get(value)
+            if probe is None:
+                probe = result.created[value] = bucket()
+                bump(self.mem, result.tokens, self.absent)
+                bump(self.mem, result.tokens, probe.token)
+            elif len(probe.members) + delta > 0:
+                bump(self.mem, result.tokens, probe.token)
+            else:
+                ## A transaction that read the token of an empty bucket
+                ## conflicts because the token is deleted.
+                result.emptied.append(value)
+                result.tokens[probe.token] = Deleted
+        return result
+
+    def apply(self, plan):
+        """Make the changes planned by plan().  Called by memory once
+        the commit can't fail."""
+
+        for (cursor, value) in plan.removed:
+            del self.buckets[value].members[cursor.__id__]
+            del self.values[cursor.__id__]
+        self.buckets.update(plan.created)
+        for (cursor, value) in plan.inserted:
+            self.buckets[value].members[cursor.__id__] = cursor
+            self.values[cursor.__id__] = value
+        for value in plan.emptied:
+            del self.buckets[value]
+
+    def covers(self, cursor):
+        return (
+            not isinstance(cursor, token)
+            and (self.kind is None or isinstance(cursor, self.kind))
+        )
+
+    def extract(self, state):
+        """Return the value of field in state.  Values that can't be
+        hashed aren't indexed."""
+
+        if state is Deleted:
+            return Undefined
+        elif callable(self.field):
+            value = self.field(state)
+        else:
+            try:
+                value = state.get(self.field, Undefined)
+            except AttributeError:
+                return Undefined
+        try:
+            hash(value)
+        except TypeError:
+            return Undefined
+        return value
+
+    ## Queries
+
+    def adjust(self, journal, members, match):
+        """Apply the uncommitted changes made by journal and its
+        sources to members, a dictionary of committed cursors that
+        match a query."""
+
+        for (cursor, state) in uncommitted(journal):
+            if self.covers(cursor):
+                if match(self.extract(state)):
+                    members[cursor.__id__] = cursor
+                else:
+                    members.pop(cursor.__id__, None)
+        return members
+
+class changes(object):
+    """The changes planned for an index by a commit.  The tokens map
+    token cursors to their new versions (or Deleted)."""
+
+    __slots__ = ('tokens', 'removed', 'inserted', 'created', 'emptied')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.removed = []
+        self.inserted = []
+        self.created = {}
+        self.emptied = []
+
+def bump(mem, tokens, cursor):
+    if cursor not in tokens:
+        tokens[cursor] = mem.mem.get(cursor, 0) + 1
+
+def uncommitted(journal):
+    """Produce the latest uncommitted (cursor, state) items written by
+    journal and its sources."""
+
+    seen = set()
+    while not isinstance(journal, Memory):
+        for (cursor, state) in journal.write_log:
+            if cursor.__id__ not in seen:
+                seen.add(cursor.__id__)
+                yield (cursor, state)
+        journal = journal.source
+
+
+### Sorted Index
+
+class sorted_index(index):
+    """An index that also answers range queries in O(log n) time.
+
+    Every change to a sorted index writes a new version of a single
+    range token, so range queries conflict with any commit that
+    changes the index.
+    """
+
+    def __init__(self, field, kind=None):
+        super(sorted_index, self).__init__(field, kind)
+        self.keys = []
+        self.cursors = {}
+        self.range_token = token()
+
+    def range(self, low=None, high=None):
+        """Return the cursors whose field is at least low and less
+        than high in order of their values."""
+
+        journal = current_journal()
+        keys = self.keys
+        with self.mem.write_lock:
+            readable_state(journal, self.range_token)
+            start = 0 if low is None else bisect.bisect_left(keys, (low, ))
+            stop = (
+                len(keys) if high is None
+                else bisect.bisect_left(keys, (high, ))
+            )
+            members = dict(
+                (key, (value, self.cursors[key]))
+                for (value, key) in keys[start:stop]
+            )
+
+        match = lambda v: (
+            v is not Undefined
+            and (low is None or v >= low)
+            and (high is None or v < high)
+        )
+        for (cursor, state) in uncommitted(journal):
+            if self.covers(cursor):
+                value = self.extract(state)
+                if match(value):
+                    members[cursor.__id__] = (value, cursor)
+                else:
+                    members.pop(cursor.__id__, None)
+        items = sorted(members.itervalues(), key=lambda item: item[0])
+        return [c for (_, c) in items]
+
+    def build(self, mem):
+        plan = super(sorted_index, self).build(mem)
+        plan.tokens.setdefault(self.range_token, 0)
+        return plan
+
+    def plan(self, changed, tokens=None):
+        plan = super(sorted_index, self).plan(changed, tokens)
+        if plan.removed or plan.inserted:
+            bump(self.mem, plan.tokens, self.range_token)
+        return plan
+
+    def apply(self, plan):
+        super(sorted_index, self).apply(plan)
+        for (cursor, value) in plan.removed:
+            key = (value, cursor.__id__)
+            del self.keys[bisect.bisect_left(self.keys, key)]
+            del self.cursors[cursor.__id__]
+        for (cursor, value) in plan.inserted:
+            bisect.insort(self.keys, (value, cursor.__id__))
+            self.cursors[cursor.__id__] = cursor
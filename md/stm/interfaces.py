@@ -3,13 +3,14 @@ from abc import ABCMeta, abstractproperty, abstractmethod
 from collections import namedtuple, Iterable, Container
 
 __all__ = (
-    'CannotCommit', 'Abort', 'NeedsTransaction',
+    'CannotCommit', 'Abort', 'NeedsTransaction', 'QuotaExceeded',
     'Cursor', 'Journal', 'Memory', 'Change', 'Log'
 )
 
 class CannotCommit(RuntimeError): pass
 class Abort(Exception): pass
 class NeedsTransaction(Exception): pass
+class QuotaExceeded(RuntimeError): pass
 
 class Cursor(object):
     __metaclass__ = ABCMeta
@@ -39,6 +40,19 @@ class Journal(object):
     def make_journal(self):
         """Create a new journal with this journal as the source."""
 
+    def release_journal(self, journal):
+        """Called when a journal created by make_journal() is no
+        longer in use.  It may be recycled by the next call to
+        make_journal()."""
+
+    def read_intent(self, journal, cursor):
+        """Called before a journal made by this journal reads cursor
+        for the first time."""
+
+    def write_intent(self, journal, cursor):
+        """Called before a journal made by this journal writes to
+        cursor for the first time."""
+
     @abstractmethod
     def allocate(self, cursor, state):
         """Allocate a new state for cursor."""
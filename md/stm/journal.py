@@ -1,15 +1,20 @@
 from __future__ import absolute_import
-import copy, threading
+import copy, thread, threading, collections
 from ..prelude import *
+from .. import fluid
 from .interfaces import Cursor, Journal, Memory, Change, CannotCommit
-from .log import log, weaklog
+from .log import log, weaklog, typelog
+from .contention import hotspots, manager
+from .usage import usage
+from .profile import note, READ, WRITE
 
 __all__ = (
     'memory', 'journal',
     'readable_state', 'original_state', 'writable_state',
-    'change_state', 'copy_state', 'commit_transaction',
+    'change_state', 'copy_state', 'commit_transaction', 'is_written',
     'change', 'Deleted', 'Inserted',
-    'good', 'verify_read', 'verify_write', 'unverified_write'
+    'good', 'verify_read', 'verify_recent', 'verify_write',
+    'unverified_write'
 )
 
 
@@ -32,6 +37,17 @@ def change_state(method, what, *args, **kwargs):
         for cursor in list(what):
             method(cursor, *args, **kwargs)
 
+def is_written(journal, cursor):
+    """Return True if journal or one of its sources has an uncommitted
+    state for cursor.  Committed states are never changed; an
+    uncommitted state may be."""
+
+    while not isinstance(journal, Memory):
+        if cursor in journal.write_log:
+            return True
+        journal = journal.source
+    return False
+
 def commit_transaction(source, nested):
     if source is nested:
         raise RuntimeError("A journal can't be committed to itself.")
@@ -53,6 +69,9 @@ class journal(Journal):
         self.source = source
         self.read_log = self.LogType()
         self.write_log = self.LogType()
+        self.locks = []
+        self.clock = None
+        self.sites = None
 
     def __repr__(self):
         return '<%s %s>' % (type(self).__name__, str(self))
@@ -60,9 +79,19 @@ class journal(Journal):
     def __str__(self):
         return self.name
 
+    def clear(self):
+        """Forget everything this journal has read or written."""
+
+        self.read_log.clear()
+        self.write_log.clear()
+        self.sites = None
+
     def make_journal(self, name):
         return type(self)(name, self)
 
+    def write_intent(self, nested, cursor):
+        self.source.write_intent(self, cursor)
+
     def allocate(self, cursor, state):
         self.write_log.allocate(cursor, state)
         return cursor
@@ -77,19 +106,25 @@ class journal(Journal):
         try:
             return self.read_log[cursor]
         except KeyError:
+            self.source.read_intent(self, cursor)
             state = good(self.source.readable_state, cursor, Inserted)
             self.read_log[cursor] = state
+            if self.sites is not None:
+                note(self.sites, cursor, READ)
             return state
 
     def writable_state(self, cursor):
         try:
             return self.write_log[cursor]
         except KeyError:
+            self.source.write_intent(self, cursor)
             state = copy_state(self.original_state(cursor))
             self.write_log[cursor] = state
             return state
 
     def delete_state(self, cursor):
+        if cursor not in self.write_log:
+            self.source.write_intent(self, cursor)
         self.write_log[cursor] = Deleted
 
     def rollback_state(self, cursor):
@@ -99,7 +134,7 @@ class journal(Journal):
         ## A journal is single-threaded; state can be blindly copied
         ## in.
         for (cursor, orig, state) in trans.changed():
-            self._write_log[cursor] = state
+            self.write_log[cursor] = state
 
     def original(self):
         return iter(self.read_log)
@@ -110,17 +145,44 @@ class journal(Journal):
             for (k, v) in self.write_log
         )
 
+## The owner of an irrevocable memory is identified by a token bound
+## in the dynamic environment, so it's a context (e.g. a task) rather
+## than a thread when fluid uses the context or greenlet backend.
+IRREVOCABLE = fluid.cell(None, type=fluid.private)
+
 class memory(Memory):
     JournalType = journal
     LogType = weaklog
     name = None
 
-    def __init__(self, name='*memory*', check_read=True, check_write=True):
+    history_size = 256
+
+    def __init__(
+        self, name='*memory*', check_read=True, check_write=True,
+        pool_size=8, adaptive=True, summarize=None, account=False,
+        quota=None
+    ):
         self.name = name
         self.write_lock = threading.RLock()
         self.check_read = check_read
         self.check_write = check_write
+        self.summarize = summarize
+        self.clock = 0
+        self.history = collections.deque(maxlen=self.history_size)
+        self.pool_size = pool_size
+        self.local = threading.local()
+        self.gate = threading.Lock()
+        self.owner = None
+        self.hotspots = hotspots(threshold=(3 if adaptive else None))
+        self.contention = manager()
+        self.subscribers = []
+        self.indexes = []
         self.mem = self.LogType()
+        self.types = typelog()
+        self.usage = (
+            usage(quota) if (account or quota is not None) else None
+        )
+        self.profiler = None
 
     def __repr__(self):
         return '<%s %s>' % (type(self).__name__, str(self))
@@ -129,23 +191,217 @@ class memory(Memory):
         return self.name
 
     def make_journal(self, name):
-        return self.JournalType(name, self)
+        try:
+            journal = self.local.pool.pop()
+            journal.name = name
+        except (AttributeError, IndexError):
+            journal = self.JournalType(name, self)
+        journal.clock = self.clock
+        if self.profiler is not None:
+            journal.sites = {}
+        return journal
+
+    def release_journal(self, journal):
+        self.hotspots.release(journal)
+
+        ## Journals are recycled through a per-thread free list.  They
+        ## are cleared first so pooled journals don't keep cursors
+        ## alive.
+        pool = self._pool()
+        if len(pool) < self.pool_size and journal.source is self:
+            journal.clear()
+            pool.append(journal)
+
+    def _pool(self):
+        try:
+            return self.local.pool
+        except AttributeError:
+            pool = self.local.pool = []
+            return pool
+
+    @contextmanager
+    def irrevocable(self):
+        """Make this context the only one that can commit until it's
+        finished, so a transaction started in it can't conflict.
+
+        Ownership belongs to the current fluid context, not the
+        thread.  The gate isn't reentrant, so another context can't
+        commit just because it runs in the same thread.  Instead, it
+        gets a RuntimeError because waiting would never end.
+        """
+
+        if self.is_irrevocable():
+            yield
+            return
+        self._acquire_gate()
+        token = object()
+        with self.write_lock:
+            self.owner = (token, thread.get_ident())
+        try:
+            with IRREVOCABLE.let(token):
+                yield
+        finally:
+            with self.write_lock:
+                self.owner = None
+            self.gate.release()
+
+    def is_irrevocable(self):
+        owner = self.owner
+        return owner is not None and owner[0] is IRREVOCABLE.value
+
+    def _acquire_gate(self):
+        owner = self.owner
+        if owner is not None and owner[1] == thread.get_ident():
+            raise RuntimeError(
+                'An irrevocable transaction is suspended in this thread.'
+            )
+        self.gate.acquire()
+
+    def _lock_commit(self):
+        ## Acquire the commit lock once no other context owns the
+        ## memory.  The owner is checked again with the lock held.
+        while True:
+            if self.owner is not None and not self.is_irrevocable():
+                self._acquire_gate()
+                self.gate.release()
+            self.write_lock.acquire()
+            if self.owner is None or self.is_irrevocable():
+                return
+            self.write_lock.release()
+
+    def subscribe(self, subscriber):
+        """Call subscriber(changed) after each commit with the list of
+        (cursor, state) items written.  Deleted cursors have the state
+        Deleted.  Subscribers are called while the commit lock is
+        held."""
+
+        with self.write_lock:
+            self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self.write_lock:
+            self.subscribers.remove(subscriber)
+
+    def add_index(self, index):
+        """Build index from the committed states in this memory and
+        keep it up to date as transactions are committed."""
+
+        with self.write_lock:
+            plan = index.build(self)
+            self._write_tokens(plan.tokens.items())
+            index.apply(plan)
+            self.indexes.append(index)
+        return index
+
+    def remove_index(self, index):
+        with self.write_lock:
+            self.indexes.remove(index)
+
+    def read_intent(self, journal, cursor):
+        ## A hot cursor is locked before it's read, so the state a
+        ## writer reads is still current once it has the lock.
+        if not self.is_irrevocable():
+            try:
+                self.hotspots.acquire(journal, cursor)
+            except CannotCommit as exc:
+                self._profile(journal, exc.args[0])
+                raise
+
+    def write_intent(self, journal, cursor):
+        ## An irrevocable transaction doesn't need to wait for anyone;
+        ## nobody else can commit until it's done.
+        if journal.sites is not None:
+            note(journal.sites, cursor, WRITE)
+        if not self.is_irrevocable():
+            try:
+                self.contention.claim(journal, cursor)
+                self.hotspots.acquire(journal, cursor)
+            except CannotCommit as exc:
+                self._profile(journal, exc.args[0])
+                raise
 
     def allocate(self, cursor, state):
-        self.mem.allocate(cursor, state)
-        return cursor
+        with self.write_lock:
+            if cursor in self.mem:
+                raise ValueError('already allocated', cursor.__id__, state)
+            self._commit([(cursor, state)])
+            return cursor
 
     def readable_state(self, cursor):
         return self.mem[cursor]
 
-    def commit_transaction(self, trans):
+    def snapshot(self, kind=object):
+        """Return the committed (cursor, state) items of every cursor
+        that is an instance of kind.  The items are consistent with
+        each other: they are collected while no commit can happen."""
+
         with self.write_lock:
-            self._read(trans.original())
-            self._commit(self._write(trans.changed()))
+            items = []
+            for cursor in self.types.cursors(kind):
+                state = self.mem.get(cursor)
+                if state is not None:
+                    items.append((cursor, state))
+            return items
+
+    def scan(self, kind, proc, pool=None, chunksize=None):
+        """Return (cursor, proc(state)) for each item in
+        snapshot(kind).  If a thread or process pool is given, proc
+        is applied with pool.map().  States are committed states that
+        must not be changed."""
+
+        items = self.snapshot(kind)
+        states = [s for (_, s) in items]
+        if pool is None:
+            results = map(proc, states)
+        else:
+            results = pool.map(proc, states, chunksize)
+        return zip((c for (c, _) in items), results)
 
-    def _read(self, read):
-        if self.check_read:
-            verify_read(self.mem, read)
+    def commit_transaction(self, trans):
+        self._lock_commit()
+        try:
+            try:
+                self._read(trans)
+                changed = self._write(trans.changed())
+                if not self.is_irrevocable():
+                    self.contention.verify(changed)
+                if self.usage is not None:
+                    self.usage.check(changed)
+            except CannotCommit as exc:
+                self.hotspots.conflicted(exc.args[0])
+                self.contention.conflicted(trans)
+                self._profile(trans, exc.args[0])
+                raise
+            self._commit(changed)
+            self.hotspots.committed(changed)
+            self._profile(trans)
+        finally:
+            self.write_lock.release()
+
+    def _profile(self, trans, conflicts=None):
+        profiler = self.profiler
+        if profiler is None or trans.sites is None:
+            return
+        elif conflicts is None:
+            profiler.committed(trans.sites)
+        else:
+            profiler.conflicted(trans.sites, conflicts)
+
+    def _read(self, trans):
+        if not self.check_read:
+            return
+        ## Large read sets are validated against the cursors written
+        ## by commits since the transaction began, if the history
+        ## goes back far enough.
+        summarize = self.summarize
+        if summarize is not None and len(trans.read_log) > summarize:
+            if trans.clock == self.clock:
+                return
+            elif verify_recent(
+                self.mem, trans.read_log, self.history, trans.clock
+            ):
+                return
+        verify_read(self.mem, trans.original())
 
     def _write(self, changed):
         if self.check_write:
@@ -154,13 +410,52 @@ class memory(Memory):
             return unverified_write(changed)
 
     def _commit(self, changed):
+        ## Indexes write new versions of their tokens along with the
+        ## cursors they index.  Every index plans its changes before
+        ## anything is changed, so an index that fails leaves the
+        ## memory and the other indexes alone.
+        plans = [(index, index.plan(changed)) for index in self.indexes]
+
         for (cursor, state) in changed:
             if state is Deleted:
                 self.mem.pop(cursor, None)
+                self.types.discard(cursor)
             else:
+                if cursor not in self.mem:
+                    self.types.add(cursor)
                 self.mem[cursor] = state
 
+        if plans:
+            tokens = [i for (_, p) in plans for i in p.tokens.iteritems()]
+            self._write_tokens(tokens)
+            for (index, plan) in plans:
+                index.apply(plan)
+            changed = changed + tokens
+
+        if self.usage is not None:
+            self.usage.update(changed)
+
+        ## Advance the clock after the new states are visible so a
+        ## journal never sees a state newer than its clock.
+        if self.summarize is not None:
+            written = [c.__id__ for (c, _) in changed]
+            self.history.append((self.clock + 1, written))
+        self.clock += 1
+
+        for subscriber in self.subscribers:
+            subscriber(changed)
+
 
+    def _write_tokens(self, tokens):
+        ## Index tokens aren't tracked by type, so they aren't part of
+        ## a snapshot().
+        for (cursor, state) in tokens:
+            if state is Deleted:
+                self.mem.pop(cursor, None)
+            else:
+                self.mem[cursor] = state
+
+
 ### State
 
 copy_state = copy.deepcopy
@@ -194,6 +489,24 @@ def verify_read(log, read):
     if conflicts:
         raise CannotCommit(conflicts)
 
+def verify_recent(log, read_log, history, since):
+    """Verify only the entries in read_log that were written by
+    commits in history after the clock value since.  Return False if
+    history doesn't go back far enough."""
+
+    if not history or history[0][0] > since + 1:
+        return False
+    conflicts = {}
+    for (clock, written) in history:
+        if clock > since:
+            for key in written:
+                entry = read_log.entry(key)
+                if entry is not None and log.get(entry.cursor) != entry.state:
+                    conflicts[key] = tuple(entry)
+    if conflicts:
+        raise CannotCommit(conflicts.values())
+    return True
+
 def verify_write(log, changed):
     changed, conflicts = partition_conflicts(log, changed)
     if conflicts:
@@ -1,9 +1,9 @@
 from __future__ import absolute_import
-from weakref import ref
+from weakref import ref, WeakValueDictionary
 from collections import namedtuple
 from .interfaces import Log
 
-__all__ = ('log', 'weaklog', 'idlog', 'weakidlog')
+__all__ = ('log', 'weaklog', 'idlog', 'weakidlog', 'typelog')
 
 class entry(namedtuple('entry', 'cursor state')):
     pass
@@ -43,6 +43,9 @@ class log(Log):
     def __iter__(self):
         return self.entries.itervalues()
 
+    def __len__(self):
+        return len(self.entries)
+
     def __delitem__(self, cursor):
         del self.entries[self._key(cursor)]
 
@@ -171,3 +174,37 @@ class weakidlog(weaklog):
 
 
 
+
+
+### Types
+
+class typelog(object):
+    """Weakly track cursors by type."""
+
+    __slots__ = ('types', )
+
+    def __init__(self):
+        self.types = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self.types.itervalues())
+
+    def add(self, cursor):
+        try:
+            cursors = self.types[type(cursor)]
+        except KeyError:
+            cursors = self.types[type(cursor)] = WeakValueDictionary()
+        cursors[cursor.__id__] = cursor
+
+    def discard(self, cursor):
+        cursors = self.types.get(type(cursor))
+        if cursors is not None:
+            cursors.pop(cursor.__id__, None)
+
+    def cursors(self, kind=object):
+        """Produce the cursors that are instances of kind."""
+
+        for (cls, cursors) in self.types.items():
+            if issubclass(cls, kind):
+                for cursor in cursors.values():
+                    yield cursor
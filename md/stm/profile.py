@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+import sys, threading
+from collections import Counter
+
+__all__ = ('profiler', )
+
+READ = 0
+WRITE = 1
+
+PACKAGE = __name__.rpartition('.')[0]
+
+class spot(object):
+    __slots__ = ('kind', 'id', 'conflicts', 'sites')
+
+    def __init__(self, kind, id):
+        self.kind = kind
+        self.id = id
+        self.conflicts = 0
+        self.sites = Counter()
+
+    def __repr__(self):
+        return '<%s %s %s: %d>' % (
+            type(self).__name__, self.kind.__name__, self.id, self.conflicts
+        )
+
+class profiler(object):
+    """Record which cursors cause transactions to fail to commit and
+    where they were used.
+
+    Assign a profiler to memory.profiler to start profiling.  Each
+    top-level transaction then records the call site of the first
+    read and the first write of each cursor it uses.  Whenever a
+    CannotCommit exception is raised, the conflicting cursors are
+    counted along with the sites they were used at.  Each site is
+    also counted as attempted by every transaction that used it and
+    as aborted by every transaction that failed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spots = {}
+        self.attempts = Counter()
+        self.aborts = Counter()
+
+    def hotspots(self):
+        """Return a list of conflicting cursors, most frequent first."""
+
+        with self.lock:
+            return sorted(self.spots.values(), key=lambda s: -s.conflicts)
+
+    def call_sites(self):
+        """Return a list of (site, attempts, aborts) items, most
+        aborts first.  A site is a (filename, line, function)
+        triple."""
+
+        with self.lock:
+            return sorted(
+                ((s, n, self.aborts[s]) for (s, n) in self.attempts.items()),
+                key=lambda item: (-item[2], -item[1])
+            )
+
+    def report(self, limit=10, port=None):
+        port = port or sys.stdout
+        port.write('Hotspots\n')
+        for spot in self.hotspots()[:limit]:
+            port.write('%8d  %s %s\n' % (
+                spot.conflicts, spot.kind.__name__, spot.id
+            ))
+            for (site, _) in spot.sites.most_common(3):
+                port.write('%10s%s\n' % ('', format_site(site)))
+        port.write('Call sites\n')
+        for (site, attempts, aborts) in self.call_sites()[:limit]:
+            port.write('%8d  %d/%d aborted  %s\n' % (
+                aborts, aborts, attempts, format_site(site)
+            ))
+
+    def clear(self):
+        with self.lock:
+            self.spots.clear()
+            self.attempts.clear()
+            self.aborts.clear()
+
+    ## Recording
+
+    def committed(self, sites):
+        with self.lock:
+            self.attempts.update(used(sites))
+
+    def conflicted(self, sites, conflicts):
+        with self.lock:
+            for (cursor, _) in conflicts:
+                key = (type(cursor), cursor.__id__)
+                probe = self.spots.get(key)
+                if probe is None:
+                    probe = self.spots[key] = spot(*key)
+                probe.conflicts += 1
+                entry = sites.get(cursor.__id__)
+                if entry is not None:
+                    probe.sites.update(s for s in entry if s is not None)
+            sites = used(sites)
+            self.attempts.update(sites)
+            self.aborts.update(sites)
+
+def note(sites, cursor, kind):
+    """Record the call site of the first kind of access to cursor."""
+
+    entry = sites.get(cursor.__id__)
+    if entry is None:
+        entry = sites[cursor.__id__] = [None, None]
+    if entry[kind] is None:
+        entry[kind] = call_site()
+
+def used(sites):
+    return set(s for e in sites.itervalues() for s in e if s is not None)
+
+def call_site():
+    ## Find the first frame outside of this package.
+    frame = sys._getframe(2)
+    while frame is not None and inside(frame):
+        frame = frame.f_back
+    if frame is not None:
+        code = frame.f_code
+        return (code.co_filename, frame.f_lineno, code.co_name)
+
+def inside(frame):
+    return frame.f_globals.get('__name__', '').startswith(PACKAGE)
+
+def format_site((filename, line, name)):
+    return '%s:%d (%s)' % (filename, line, name)
@@ -0,0 +1,332 @@
+from __future__ import absolute_import
+import threading, weakref, uuid, itertools, multiprocessing
+import cPickle as pickle
+from cStringIO import StringIO
+from multiprocessing.connection import Listener, Client
+from ..prelude import *
+from .interfaces import Cursor, CannotCommit
+from .journal import memory, Inserted, Deleted
+from .log import weaklog
+from .cursor import dict as tdict
+
+__all__ = (
+    'client', 'server', 'serve', 'start', 'dumps', 'loads', 'ROOT',
+    'Unsupported'
+)
+
+ROOT = 'root'
+
+class Unsupported(RuntimeError):
+    pass
+
+
+### Pickling
+
+## Cursors are pickled by reference: each cursor has a global id
+## that is the same in every process.  References to other cursors
+## inside a state are replaced by (global-id, type) pairs and turned
+## back into cursors by resolve() when the state is loaded.
+
+def dumps(obj, identify):
+    """Pickle obj, replacing cursors with the persistent ids returned
+    by identify(cursor)."""
+
+    port = StringIO()
+    pickler = pickle.Pickler(port, -1)
+    pickler.persistent_id = lambda o: (
+        (identify(o), type(o)) if isinstance(o, Cursor) else None
+    )
+    pickler.dump(obj)
+    return port.getvalue()
+
+def loads(data, resolve):
+    """Unpickle data, calling resolve(gid, cls) to produce cursors."""
+
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = lambda pid: resolve(*pid)
+    return unpickler.load()
+
+
+### Server
+
+class server(object):
+    """Keep the committed state of every remote cursor.
+
+    Each state is stored as a pickled (type, state) pair with a
+    version number that is incremented each time it is committed.  A
+    commit is accepted only if the versions of everything it read or
+    wrote are still current.
+    """
+
+    def __init__(self, address, authkey=None):
+        self.listener = Listener(address, authkey=authkey)
+        self.lock = threading.Lock()
+        self.store = {ROOT: (1, dumps((tdict, {}), None))}
+
+    def serve_forever(self):
+        while True:
+            conn = self.listener.accept()
+            handler = threading.Thread(target=self.handle, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+    def handle(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                method = getattr(self, 'do_%s' % request[0])
+                conn.send(method(*request[1:]))
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+    def version(self, gid):
+        return self.store.get(gid, (None, None))[0]
+
+    def do_fetch(self, gids):
+        with self.lock:
+            return self._fetch(gids)
+
+    def do_commit(self, reads, writes):
+        with self.lock:
+            conflicts = (
+                [g for (g, v) in reads if self.version(g) != v]
+                + [g for (g, v, _) in writes if self.version(g) != v]
+            )
+            if conflicts:
+                return ('conflict', self._fetch(conflicts))
+
+            versions = []
+            for (gid, version, data) in writes:
+                if data is None:
+                    self.store.pop(gid, None)
+                else:
+                    self.store[gid] = ((version or 0) + 1, data)
+                    versions.append((gid, (version or 0) + 1))
+            return ('ok', versions)
+
+    def _fetch(self, gids):
+        return [(g, ) + self.store.get(g, (None, None)) for g in gids]
+
+def serve(address, authkey=None, ready=None):
+    """Run a server until the process is terminated."""
+
+    instance = server(address, authkey)
+    if ready is not None:
+        ready.set()
+    instance.serve_forever()
+
+def start(address, authkey=None):
+    """Start a server in a new daemonic process.  Return the process
+    once the server is accepting connections."""
+
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(
+        target=serve,
+        args=(address, authkey, ready),
+        name='stm-server'
+    )
+    proc.daemon = True
+    proc.start()
+    ready.wait()
+    return proc
+
+
+### Client
+
+class remote(object):
+    __slots__ = ('gid', 'version')
+
+    def __init__(self, gid, version=None):
+        self.gid = gid
+        self.version = version
+
+class client(memory):
+    """A memory backed by a server in another process.
+
+    Committed states are cached locally and validated by version when
+    a transaction is committed, so unchanged states are only fetched
+    once.  Cursors that are referenced by a loaded state, but haven't
+    been loaded themselves, are fetched along with the next cache
+    miss in batches of up to batch_size.
+    """
+
+    def __init__(self, address, authkey=None, name=None, batch_size=64, **kw):
+        super(client, self).__init__(name or str(address), **kw)
+        self.conn = Client(address, authkey=authkey)
+        self.conn_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.remotes = weaklog()
+        self.cursors = weakref.WeakValueDictionary()
+        self.pending = set()
+        self.prefix = uuid.uuid4().hex
+        self.serial = itertools.count()
+
+    def close(self):
+        with self.conn_lock:
+            self.conn.close()
+
+    def request(self, *request):
+        with self.conn_lock:
+            self.conn.send(request)
+            return self.conn.recv()
+
+    def root(self):
+        """Return the root cursor, a transactional dict that is shared
+        by every client of the server."""
+
+        return self.resolve(ROOT, tdict)
+
+    ## Identity
+
+    def identify(self, cursor):
+        """Return the global id of cursor, assigning one if it's
+        new."""
+
+        try:
+            return self.remotes[cursor].gid
+        except KeyError:
+            gid = '%s.%d' % (self.prefix, next(self.serial))
+            self.remotes[cursor] = remote(gid)
+            self.cursors[gid] = cursor
+            return gid
+
+    def resolve(self, gid, cls):
+        """Return the cursor for a global id.  Its state is loaded
+        lazily."""
+
+        try:
+            return self.cursors[gid]
+        except KeyError:
+            cursor = self.cursors[gid] = object.__new__(cls)
+            self.remotes[cursor] = remote(gid)
+            self.pending.add(gid)
+            self.types.add(cursor)
+            return cursor
+
+    ## Fetching
+
+    def fetch(self, gids):
+        for (gid, version, data) in self.request('fetch', list(gids)):
+            self.load(gid, version, data)
+
+    def prefetch(self, *cursors):
+        """Load the states of several cursors in one request."""
+
+        missing = [c for c in cursors if c not in self.mem]
+        if missing:
+            self.fetch(self.remotes[c].gid for c in missing)
+
+    def load(self, gid, version, data):
+        if data is None:
+            self.pending.discard(gid)
+            cursor = self.cursors.get(gid)
+            if cursor is not None:
+                self.cache(cursor, Deleted)
+            return
+
+        (cls, state) = loads(data, self.resolve)
+        cursor = self.resolve(gid, cls)
+        self.pending.discard(gid)
+        self.remotes[cursor].version = version
+        self.cache(cursor, state)
+
+    def cache(self, cursor, state):
+        ## A fetched state isn't a commit, so it doesn't go through
+        ## _commit(), but it's still counted by usage.
+        if state is Deleted:
+            self.mem.pop(cursor, None)
+        else:
+            self.mem[cursor] = state
+        if self.usage is not None:
+            self.usage.update([(cursor, state)])
+
+    def readable_state(self, cursor):
+        try:
+            return self.mem[cursor]
+        except KeyError:
+            gid = self.remotes[cursor].gid
+
+        with self.write_lock:
+            if cursor not in self.mem:
+                self.pending.discard(gid)
+                batch = [gid] + list(islice(self.pending, self.batch_size - 1))
+                self.fetch(batch)
+            return self.mem[cursor]
+
+    ## Committing
+
+    def allocate(self, cursor, state):
+        with self.write_lock:
+            data = dumps((type(cursor), state), self.identify)
+            self._commit_remote([], [(self.identify(cursor), None, data)])
+            self._commit([(cursor, state)])
+            return cursor
+
+    def irrevocable(self):
+        raise Unsupported(
+            'Irrevocable transactions are not supported by %r.' % self
+        )
+
+    def add_index(self, index):
+        raise Unsupported('Indexes are not supported by %r.' % self)
+
+    def commit_transaction(self, trans):
+        with self.write_lock:
+            try:
+                changed = list(trans.changed())
+                reads = [
+                    self._read_version(c, s)
+                    for (c, s) in trans.original()
+                    if not isinstance(s, Sentinal)
+                ]
+                writes = [
+                    self._write_version(c, o, s)
+                    for (c, o, s) in changed
+                ]
+                if self.usage is not None:
+                    self.usage.check([(c, s) for (c, o, s) in changed])
+                self._commit_remote(reads, writes)
+            except CannotCommit as exc:
+                self.hotspots.conflicted(exc.args[0])
+                self.contention.conflicted(trans)
+                self._profile(trans, exc.args[0])
+                raise
+
+            changed = [(c, s) for (c, o, s) in changed]
+            self._commit(changed)
+            self.hotspots.committed(changed)
+            self._profile(trans)
+
+    def _read_version(self, cursor, state):
+        if self.mem.get(cursor) is not state:
+            ## The cache was refreshed by another thread.
+            raise CannotCommit([(cursor, state)])
+        entry = self.remotes[cursor]
+        return (entry.gid, entry.version)
+
+    def _write_version(self, cursor, orig, state):
+        gid = self.identify(cursor)
+        if orig is Inserted:
+            version = None
+        elif self.mem.get(cursor) is not orig:
+            raise CannotCommit([(cursor, orig)])
+        else:
+            version = self.remotes[cursor].version
+        if state is Deleted:
+            return (gid, version, None)
+        return (gid, version, dumps((type(cursor), state), self.identify))
+
+    def _commit_remote(self, reads, writes):
+        (status, result) = self.request('commit', reads, writes)
+        if status == 'conflict':
+            conflicts = []
+            for (gid, version, data) in result:
+                self.load(gid, version, data)
+                cursor = self.cursors.get(gid)
+                if cursor is not None:
+                    conflicts.append((cursor, self.mem.get(cursor)))
+            raise CannotCommit(conflicts)
+        for (gid, version) in result:
+            self.remotes[self.cursors[gid]].version = version
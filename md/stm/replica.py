@@ -0,0 +1,296 @@
+from __future__ import absolute_import
+import threading, weakref, itertools, collections, time
+from functools import partial
+from multiprocessing.connection import Listener, Client
+from .journal import memory, Deleted
+from .log import log
+from .remote import dumps, loads
+
+__all__ = ('publisher', 'replica', 'ReadOnly')
+
+class ReadOnly(RuntimeError):
+    pass
+
+
+### Primary
+
+class publisher(object):
+    """Publish the commits made to a memory to replicas connected at
+    address.
+
+    A replica that connects is first sent a snapshot of every cursor
+    in the memory.  After that, the (cursor, state) items written by
+    each commit are added to the replica's pending batch before the
+    commit returns.  Each replica has a sender thread of its own that
+    sends the pending batch as soon as the last one has been sent, so
+    a slow replica never holds up a commit and never lags by more
+    than one batch.  Commits made while a batch is being sent are
+    coalesced into the next one.
+
+    Cursors are pickled as persistent ids (see stm.remote.dumps()).
+    The publisher gives each cursor a serial number that is never
+    reused.  When the primary garbage collects a cursor, its number
+    is sent with the next batch and the replica deletes the cursor.
+    """
+
+    def __init__(self, mem, address, authkey=None, root=None):
+        self.mem = mem
+        self.root = root
+        self.listener = Listener(address, authkey=authkey)
+        self.channels = []
+        self.gids = {}
+        self.refs = {}
+        self.serial = itertools.count(1)
+        self.collected = collections.deque()
+        mem.subscribe(self.publish)
+
+        acceptor = threading.Thread(target=self.accept)
+        acceptor.daemon = True
+        acceptor.start()
+
+    def close(self):
+        self.mem.unsubscribe(self.publish)
+        for channel in self.channels:
+            channel.close()
+        self.listener.close()
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (IOError, EOFError):
+                return
+            ## Take the snapshot under the commit lock so no batch is
+            ## missed.
+            with self.mem.write_lock:
+                channel = sender(self, conn, self.snapshot())
+                self.channels.append(channel)
+
+    def snapshot(self):
+        items = [(self.identify(c), c, s) for (c, s) in self.mem.mem]
+        return self.dumps('snapshot', self.mem.clock, (self.root, items))
+
+    def publish(self, changed):
+        if self.channels:
+            clock = self.mem.clock
+            collected = self.forgotten()
+            for channel in list(self.channels):
+                if not channel.add(clock, changed, collected):
+                    self.channels.remove(channel)
+
+    def batch(self, clock, changed, collected):
+        ## Called by a sender with the commit lock held, so cursors
+        ## are identified consistently.
+        items = [
+            (self.identify(c), c, None if s is Deleted else s)
+            for (c, s) in changed
+        ]
+        return self.dumps('batch', clock, (items, collected))
+
+    def dumps(self, kind, clock, payload):
+        return dumps((kind, clock, payload), self.identify)
+
+    def identify(self, cursor):
+        key = cursor.__id__
+        try:
+            return self.gids[key]
+        except KeyError:
+            gid = self.gids[key] = next(self.serial)
+            self.refs[gid] = weakref.ref(
+                cursor, partial(self.collect, key, gid)
+            )
+            return gid
+
+    def collect(self, key, gid, ref):
+        ## Called when a cursor is garbage collected, in any thread and
+        ## possibly while a lock is held; only atomic operations are
+        ## used.
+        if self.gids.get(key) == gid:
+            del self.gids[key]
+        self.refs.pop(gid, None)
+        if self.channels:
+            self.collected.append(gid)
+
+    def forgotten(self):
+        gids = []
+        try:
+            while True:
+                gids.append(self.collected.popleft())
+        except IndexError:
+            return gids
+
+class sender(object):
+    """Send a snapshot and then batches to a replica from a thread of
+    its own.  Changes added while a batch is being sent are pending
+    until it's done; then they're sent as one batch."""
+
+    def __init__(self, publisher, conn, snapshot):
+        self.publisher = publisher
+        self.conn = conn
+        self.snapshot = snapshot
+        self.cond = threading.Condition(threading.Lock())
+        self.changed = {}
+        self.collected = []
+        self.clock = None
+        self.closed = False
+
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, clock, changed, collected):
+        """Add the changes made by a commit to the pending batch.
+        Return False if the connection is closed."""
+
+        with self.cond:
+            if self.closed:
+                return False
+            ## Some cursors (e.g. lists) aren't hashable.
+            self.changed.update((c.__id__, (c, s)) for (c, s) in changed)
+            self.collected.extend(collected)
+            self.clock = clock
+            self.cond.notify()
+            return True
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.conn.close()
+
+    def run(self):
+        try:
+            self.conn.send_bytes(self.snapshot)
+            self.snapshot = None
+            while True:
+                data = self.pending()
+                if data is None:
+                    break
+                self.conn.send_bytes(data)
+        except (IOError, EOFError):
+            pass
+        self.close()
+
+    def pending(self):
+        with self.cond:
+            while self.clock is None and not self.closed:
+                self.cond.wait()
+        ## Take the commit lock first, like add() is called.
+        with self.publisher.mem.write_lock:
+            with self.cond:
+                if self.closed:
+                    return None
+                batch = self.publisher.batch(
+                    self.clock, self.changed.values(), self.collected
+                )
+                self.changed = {}
+                self.collected = []
+                self.clock = None
+                return batch
+
+
+### Replica
+
+class replica(memory):
+    """A read-only memory that mirrors a memory published at address.
+
+    Transactions may read from a replica, but a ReadOnly exception is
+    raised if they try to write.  Batches are applied atomically, and
+    read-logs are verified when a transaction is committed, so a
+    transaction always sees a consistent snapshot.
+    """
+
+    LogType = log
+
+    def __init__(self, address, authkey=None, name=None, **kwargs):
+        super(replica, self).__init__(name or str(address), **kwargs)
+        self.conn = Client(address, authkey=authkey)
+        self.cursors = {}
+        self.applied = None
+        self._root = None
+        self.caught_up = threading.Condition(threading.Lock())
+
+        receiver = threading.Thread(target=self.receive)
+        receiver.daemon = True
+        receiver.start()
+        self.wait(0)
+
+    def root(self):
+        """Return the replica of the root given to the publisher."""
+
+        return self._root
+
+    def wait(self, clock, timeout=None):
+        """Wait until the commit made at clock by the primary has been
+        applied.  Return True if it has."""
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.caught_up:
+            while self.applied < clock:
+                if timeout is None:
+                    self.caught_up.wait()
+                elif deadline > time.time():
+                    self.caught_up.wait(deadline - time.time())
+                else:
+                    break
+            return self.applied >= clock
+
+    def close(self):
+        self.conn.close()
+
+    def receive(self):
+        try:
+            while True:
+                data = self.conn.recv_bytes()
+                (kind, clock, payload) = loads(data, self.resolve)
+                getattr(self, 'apply_%s' % kind)(clock, payload)
+        except (IOError, EOFError):
+            pass
+
+    def resolve(self, gid, cls):
+        ## Replicated cursors are kept alive by the replica until the
+        ## primary deletes or collects them.
+        cursor = self.cursors.get(gid)
+        if type(cursor) is not cls:
+            cursor = self.cursors[gid] = object.__new__(cls)
+        return cursor
+
+    def apply_snapshot(self, clock, (root, items)):
+        with self.write_lock:
+            self.mem.clear()
+            self._commit([(c, s) for (_, c, s) in items])
+            self._root = root
+            self.caught_up_to(clock)
+
+    def apply_batch(self, clock, (items, collected)):
+        with self.write_lock:
+            changed = []
+            for (gid, cursor, state) in items:
+                if state is None:
+                    self.cursors.pop(gid, None)
+                    changed.append((cursor, Deleted))
+                else:
+                    changed.append((cursor, state))
+            for gid in collected:
+                cursor = self.cursors.pop(gid, None)
+                if cursor is not None:
+                    changed.append((cursor, Deleted))
+            self._commit(changed)
+            self.caught_up_to(clock)
+
+    def caught_up_to(self, clock):
+        with self.caught_up:
+            self.applied = clock
+            self.caught_up.notify_all()
+
+    def allocate(self, cursor, state):
+        raise ReadOnly('Cannot allocate in a replica.', cursor)
+
+    def write_intent(self, journal, cursor):
+        raise ReadOnly('Cannot write to a replica.', cursor)
+
+    def commit_transaction(self, trans):
+        for change in trans.changed():
+            raise ReadOnly('Cannot commit changes to a replica.', change)
+        super(replica, self).commit_transaction(trans)
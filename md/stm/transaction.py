@@ -4,11 +4,12 @@ from contextlib import contextmanager
 from md import fluid
 from .interfaces import *
 from .journal import *
+from .contention import ticket
 
 __all__ = (
     'initialize', 'current_journal', 'current_memory',
     'allocate', 'readable', 'writable', 'delete',
-    'use', 'transaction', 'transactionally',
+    'use', 'transaction', 'transactionally', 'irrevocable',
     'rollback', 'commit', 'abort',
     'changed'
 )
@@ -37,26 +38,52 @@ def use(mem=None):
 
 @contextmanager
 def transaction(name='*nested*', autocommit=True):
+    source = current_journal()
+    journal = source.make_journal(name)
     try:
-        with current_journal(current_journal().make_journal(name)):
+        with current_journal(journal):
             yield
             if autocommit:
                 autocommit() if callable(autocommit) else commit()
     except Abort:
         pass
+    finally:
+        source.release_journal(journal)
+
+@contextmanager
+def irrevocable(name='*irrevocable*', autocommit=True):
+    source = current_journal()
+    if not isinstance(source, Memory):
+        raise RuntimeError('An irrevocable transaction must be top-level.')
+    with source.irrevocable():
+        with transaction(name, autocommit):
+            yield
 
 def transactionally(proc, *args, **kwargs):
     limit = kwargs.pop('__attempts__', 3)
     autocommit = kwargs.pop('autocommit', True)
 
-    for attempt in xrange(limit):
-        try:
-            with transaction(autocommit=autocommit):
-                return proc(*args, **kwargs)
-        except CannotCommit as exc:
-            pass
+    with contending(current_journal()) as ticket:
+        for attempt in xrange(limit):
+            try:
+                with ticket.attempt():
+                    with transaction(autocommit=autocommit):
+                        return proc(*args, **kwargs)
+            except CannotCommit as exc:
+                pass
     raise exc
 
+@contextmanager
+def contending(journal):
+    ## Only top-level transactions compete with each other; nested
+    ## transactions get a ticket with no manager.
+    manager = getattr(journal, 'contention', None)
+    if manager is None:
+        yield ticket()
+    else:
+        with manager.contending() as issued:
+            yield issued
+
 def commit(journal=None):
     journal = journal or current_journal()
     return commit_transaction(journal.source, journal)
@@ -88,7 +115,14 @@ def find_memory(journal):
 
 JOURNAL = fluid.cell(type=acquire_memory)
 
-current_journal = fluid.accessor(JOURNAL, name='current_journal')
+def default_journal():
+    ## The default memory is made the first time it's needed.
+    JOURNAL.value = journal = default_memory()
+    return journal
+
+current_journal = fluid.accessor(
+    JOURNAL, name='current_journal', missing=default_journal
+)
 
 def current_memory():
     return find_memory(current_journal())
@@ -98,3 +132,14 @@ def initialize(mem=None):
     if isinstance(journal, Journal) and not isinstance(journal, Memory):
         raise RuntimeError('Cannot uninitialize a transaction', journal)
     JOURNAL.value = mem or memory()
+
+INITIALIZE = threading.Lock()
+
+def default_memory():
+    ## Threads that localized JOURNAL before it was initialized share
+    ## the global default.
+    with INITIALIZE:
+        loc = JOURNAL._global
+        if loc.value is fluid.UNDEFINED:
+            loc.value = memory()
+        return loc.value
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+import sys
+from weakref import ref
+from ..prelude import Sentinal
+from .interfaces import QuotaExceeded
+
+__all__ = ('usage', )
+
+class sized(ref):
+    __slots__ = ('id', 'kind', 'size')
+
+    def __new__(cls, cursor, callback):
+        self = ref.__new__(cls, cursor, callback)
+        self.id = cursor.__id__
+        self.kind = type(cursor)
+        self.size = 0
+        return self
+
+    def __init__(self, cursor, callback):
+        super(sized, self).__init__(cursor, callback)
+
+class usage(object):
+    """Keep running totals of the approximate size of committed
+    states by cursor type.
+
+    The size of a state is measure(state); by default, this is
+    sys.getsizeof(), which doesn't include the size of objects the
+    state refers to.  Totals are adjusted by the difference in size
+    each time a state is committed, and when a cursor is deleted or
+    garbage collected.
+
+    If quota is not None, a commit that would grow the total beyond
+    quota bytes is rejected with a QuotaExceeded exception.  Commits
+    that shrink the total are always accepted.
+    """
+
+    def __init__(self, quota=None, measure=sys.getsizeof):
+        self.quota = quota
+        self.measure = measure
+        self.total = 0
+        self.kinds = {}
+        self.sizes = {}
+
+    def __repr__(self):
+        return '<%s %d bytes>' % (type(self).__name__, self.total)
+
+    def stats(self):
+        """Return a dictionary that maps each cursor type to a
+        (count, bytes) pair."""
+
+        return dict((k, tuple(v)) for (k, v) in self.kinds.items() if v[0])
+
+    def check(self, changed):
+        """Raise QuotaExceeded if committing changed would grow the
+        total beyond the quota."""
+
+        if self.quota is None:
+            return
+        delta = 0
+        for (cursor, state) in changed:
+            probe = self.sizes.get(cursor.__id__)
+            delta += (
+                (0 if isinstance(state, Sentinal) else self.measure(state))
+                - (0 if probe is None else probe.size)
+            )
+        if delta > 0 and self.total + delta > self.quota:
+            raise QuotaExceeded(
+                'Commit would use %d of %d bytes.'
+                % (self.total + delta, self.quota)
+            )
+
+    def update(self, changed):
+        """Adjust the totals for committed (cursor, state) items."""
+
+        for (cursor, state) in changed:
+            probe = self.sizes.get(cursor.__id__)
+            if isinstance(state, Sentinal):
+                if probe is not None:
+                    self.forget(probe)
+                continue
+            elif probe is None:
+                probe = self.sizes[cursor.__id__] = sized(cursor, self.forget)
+                self.adjust(probe.kind, 1, 0)
+            size = self.measure(state)
+            self.adjust(probe.kind, 0, size - probe.size)
+            probe.size = size
+
+    def forget(self, probe):
+        if self.sizes.get(probe.id) is probe:
+            del self.sizes[probe.id]
+            self.adjust(probe.kind, -1, -probe.size)
+
+    def adjust(self, kind, count, size):
+        try:
+            totals = self.kinds[kind]
+        except KeyError:
+            totals = self.kinds[kind] = [0, 0]
+        totals[0] += count
+        totals[1] += size
+        self.total += size
@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+from ..prelude import *
+from .interfaces import Cursor, Memory
+from .journal import Inserted, good
+from .transaction import current_journal, find_memory
+
+__all__ = ('view', )
+
+class memo(object):
+    __slots__ = ('args', 'value', 'deps')
+
+    def __init__(self, args, value, deps):
+        self.args = args
+        self.value = value
+        self.deps = deps
+
+class view(object):
+    """Memoize a procedure of cursor states.
+
+    The result of proc(*args) is cached along with the states of the
+    cursors proc read.  A commit that changes one of those cursors
+    invalidates the result.  Results are cached for each distinct
+    set of arguments, so an aggregate over many cursors can be kept
+    up to date incrementally by combining the results of a view
+    called once per cursor.
+
+    Calling a view in a transaction adds the cursors it depends on to
+    the transaction's read-log, just as if proc had been called, so
+    the transaction conflicts with any commit that would change the
+    result.  Results that depend on changes the transaction hasn't
+    committed yet are not cached.
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.mem = None
+        self.cache = {}
+        self.dependents = {}
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.proc)
+
+    def __call__(self, *args):
+        journal = current_journal()
+        key = identify(args)
+        entry = self.cache.get(key)
+        if entry is not None and depend(journal, entry.deps):
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+        return self.compute(journal, key, args)
+
+    def close(self):
+        """Stop tracking commits and forget all cached results."""
+
+        if self.mem is not None:
+            self.mem.unsubscribe(self.invalidate)
+            self.mem = None
+        self.clear()
+
+    def clear(self):
+        self.cache.clear()
+        self.dependents.clear()
+
+    def compute(self, journal, key, args):
+        nested = journal.make_journal('*view*')
+        try:
+            with current_journal(nested):
+                value = self.proc(*args)
+            if any(nested.changed()):
+                raise RuntimeError('A view cannot change cursors.', self)
+            deps = list(nested.original())
+        finally:
+            journal.release_journal(nested)
+
+        self.store(find_memory(journal), key, args, value, deps)
+        return value
+
+    def store(self, mem, key, args, value, deps):
+        if self.mem is None:
+            self.mem = mem
+            mem.subscribe(self.invalidate)
+        elif mem is not self.mem:
+            return
+
+        ## The result can only be cached if it was computed from
+        ## committed states that are still current.
+        with mem.write_lock:
+            for (cursor, state) in deps:
+                if good(mem.readable_state, cursor, Inserted) is not state:
+                    return
+            self.forget(key)
+            self.cache[key] = memo(args, value, deps)
+            for (cursor, _) in deps:
+                self.dependents.setdefault(cursor.__id__, set()).add(key)
+
+    def invalidate(self, changed):
+        dependents = self.dependents
+        if dependents:
+            for (cursor, _) in changed:
+                for key in list(dependents.get(cursor.__id__, ())):
+                    self.forget(key)
+
+    def forget(self, key):
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            for (cursor, _) in entry.deps:
+                keys = self.dependents.get(cursor.__id__)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.dependents[cursor.__id__]
+
+def identify(args):
+    ## Collections aren't hashable; a memo keeps its arguments alive,
+    ## so their ids are unique while the memo is cached.
+    return tuple(
+        (Cursor, a.__id__) if isinstance(a, Cursor) else a
+        for a in args
+    )
+
+def depend(journal, deps):
+    """Add deps to the read-logs of journal and its sources.  Return
+    False if one of them has read or written a different state."""
+
+    while not isinstance(journal, Memory):
+        (read_log, write_log) = (journal.read_log, journal.write_log)
+        for (cursor, state) in deps:
+            if cursor in write_log:
+                return False
+            current = read_log.get(cursor, Undefined)
+            if current is Undefined:
+                read_log[cursor] = state
+            elif current is not state:
+                return False
+        journal = journal.source
+    return True
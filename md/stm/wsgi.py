@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+import time
+from cStringIO import StringIO
+from md import fluid
+from .interfaces import CannotCommit, Abort
+from .journal import commit_transaction
+from .transaction import JOURNAL, current_memory, contending
+
+__all__ = ('middleware', 'current_request')
+
+REQUEST = fluid.cell(None)
+
+current_request = fluid.accessor(REQUEST, name='current_request')
+
+class middleware(object):
+    """Run each request to a WSGI application in a transaction.
+
+    The request's environ and a new top-level transaction are bound in
+    a single let() for the extent of the request, so the application
+    can use current_request() and stm without opening a transaction of
+    its own.  The transaction is committed after the application has
+    produced its whole response.  If the commit fails, the request is
+    retried up to attempts times.  The response (including the call
+    to start_response) is buffered until the commit succeeds, so each
+    attempt starts from scratch.  If the application calls abort(),
+    nothing is committed and the buffered response is sent as is.
+    Journals come from the memory's per-thread pool.
+
+    The STM stats of each request are put into environ['md.stm'] and
+    passed to observe(environ, stats) if it's given.
+    """
+
+    def __init__(self, app, mem=None, attempts=3, observe=None):
+        if attempts < 1:
+            raise ValueError('attempts must be at least 1', attempts)
+        self.app = app
+        self.mem = mem
+        self.attempts = attempts
+        self.observe = observe
+        self.requests = 0
+        self.conflicts = 0
+        self.failures = 0
+        self.aborts = 0
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.app)
+
+    def __call__(self, environ, start_response):
+        mem = self.mem or current_memory()
+        data = self.attempts > 1 and read_input(environ)
+        started = time.time()
+
+        with contending(mem) as ticket:
+            for attempt in xrange(1, self.attempts + 1):
+                if data is not False:
+                    environ['wsgi.input'] = StringIO(data)
+                try:
+                    with ticket.attempt():
+                        (response, stats) = self.attempt(mem, environ)
+                    break
+                except CannotCommit as exc:
+                    self.conflicts += 1
+            else:
+                self.failures += 1
+                raise exc
+
+        self.requests += 1
+        stats.update(attempts=attempt, seconds=time.time() - started)
+        environ['md.stm'] = stats
+        if self.observe is not None:
+            self.observe(environ, stats)
+        return response.send(start_response)
+
+    def attempt(self, mem, environ):
+        journal = mem.make_journal('*request*')
+        try:
+            response = buffered()
+            try:
+                with fluid.let((JOURNAL, journal), (REQUEST, environ)):
+                    response.run(self.app, environ)
+            except Abort:
+                self.aborts += 1
+                aborted = True
+            else:
+                aborted = False
+            stats = dict(
+                reads=len(journal.read_log),
+                writes=len(journal.write_log)
+            )
+            if not aborted:
+                commit_transaction(mem, journal)
+            return (response, stats)
+        finally:
+            mem.release_journal(journal)
+
+def read_input(environ):
+    ## The request body is read once so that it can be replayed when
+    ## a request is retried.
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    return environ['wsgi.input'].read(length) if length > 0 else ''
+
+class buffered(object):
+    """Collect a WSGI response so that it can be sent later."""
+
+    def __init__(self):
+        self.status = None
+        self.headers = None
+        self.exc_info = None
+        self.body = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = headers
+        self.exc_info = exc_info
+        return self.body.append
+
+    def run(self, app, environ):
+        result = app(environ, self.start_response)
+        try:
+            self.body.extend(result)
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+    def send(self, start_response):
+        if self.exc_info is None:
+            start_response(self.status, self.headers)
+        else:
+            start_response(self.status, self.headers, self.exc_info)
+        return self.body
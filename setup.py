@@ -11,7 +11,7 @@ setup(
     license = 'BSD',
     keywords = 'utilities transaction transactions fluid dynamic',
 
-    packages = list(find_packages(exclude=('tests', 'docs', 'docs.*'))),
+    packages = list(find_packages(exclude=('tests', 'bench', 'docs', 'docs.*'))),
     install_requires = 'importlib',
     scripts = ['bin/pytest'],
     test_suite = 'tests.all',